@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import AsyncGenerator, Dict, Optional
+
+import httpx
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# Как часто собирать счётчики сервисов и рассылать изменения
+DASHBOARD_INTERVAL_SECONDS = float(os.getenv("DASHBOARD_INTERVAL_SECONDS", 2))
+# Таймаут опроса одного сервиса: дольше тика ждать нельзя
+DASHBOARD_FETCH_TIMEOUT = min(1.0, DASHBOARD_INTERVAL_SECONDS / 2)
+# Столько неотправленных кадров у зрителя - дальше он получит полный снимок
+DASHBOARD_MAX_BACKLOG = 10
+# Откуда брать счётчики (внутренняя сеть docker, мимо gateway)
+DASHBOARD_SOURCES = {
+    "chat": os.getenv("CHAT_MAIN_STATS_URL", "http://chat_main:8010/stats"),
+    "rooms": os.getenv("ROOMS_STATS_URL", "http://rooms:8013/stats"),
+}
+
+AUTH_LOGINS = Counter("auth_logins_total", "Попытки входа", ["result"])
+
+
+class Dashboard:
+    """
+    Живая панель администратора.
+
+    Пока есть хотя бы один зритель, раз в DASHBOARD_INTERVAL_SECONDS опрашивает
+    /stats сервисов (по одному запросу на сервис, сколько бы зрителей ни было),
+    добавляет свои счётчики и считает скорости. Кадр изменений кодируется
+    один раз за тик и кладётся в очереди всех зрителей.
+    """
+
+    def __init__(self, interval: float = DASHBOARD_INTERVAL_SECONDS):
+        self.interval = interval
+        self.snapshot: Dict = {}
+        # очередь зрителя -> нужен ли ему полный снимок (отстал и пропустил кадры)
+        self._subscribers: Dict[asyncio.Queue, bool] = {}
+        self._totals: Dict[str, float] = {}
+        self._last_tick: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _local_stats(self) -> Dict:
+        return {
+            "logins_total": AUTH_LOGINS.value(result="ok"),
+            "login_failures_total": AUTH_LOGINS.value(result="failed"),
+        }
+
+    async def _fetch(self, client: httpx.AsyncClient, url: str) -> Optional[Dict]:
+        try:
+            response = await client.get(url)
+            response.raise_for_status()
+            return response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            logger.warning(f"Счётчики недоступны: {url}: {e}")
+            return None
+
+    def _rates(self, values: Dict, now: float) -> Dict:
+        """Скорость в секунду по счётчикам *_total с прошлого тика"""
+        rates = {}
+        elapsed = now - self._last_tick if self._last_tick is not None else None
+        for key, value in values.items():
+            if not key.endswith("_total") or value is None:
+                continue
+            previous = self._totals.get(key)
+            self._totals[key] = value
+            if elapsed and previous is not None:
+                rates[key[:-len("_total")] + "_per_s"] = round(max(value - previous, 0) / elapsed, 2)
+        return rates
+
+    async def collect(self, client: httpx.AsyncClient) -> Dict:
+        names = list(DASHBOARD_SOURCES)
+        results = await asyncio.gather(*(self._fetch(client, DASHBOARD_SOURCES[name]) for name in names))
+
+        values: Dict = {}
+        for name, result in zip(names, results):
+            # Недоступный сервис виден на панели, а не пропадает молча
+            values[f"{name}_up"] = result is not None
+            for key, value in (result or {}).items():
+                values[f"{name}_{key}"] = value
+        values.update({f"auth_{key}": value for key, value in self._local_stats().items()})
+
+        now = time.monotonic()
+        values.update(self._rates(values, now))
+        self._last_tick = now
+        return values
+
+    def _frame(self, event: Dict) -> str:
+        return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    def publish(self, values: Dict):
+        changed = {key: value for key, value in values.items() if self.snapshot.get(key) != value}
+        self.snapshot = values
+        snapshot_frame = None
+        delta_frame = self._frame({"type": "delta", "time": time.time(), "values": changed})
+        for subscriber, needs_snapshot in list(self._subscribers.items()):
+            if needs_snapshot:
+                if snapshot_frame is None:
+                    snapshot_frame = self._frame({"type": "snapshot", "time": time.time(), "values": values})
+                frame = snapshot_frame
+            else:
+                frame = delta_frame
+            try:
+                subscriber.put_nowait(frame)
+                self._subscribers[subscriber] = False
+            except asyncio.QueueFull:
+                self._subscribers[subscriber] = True
+
+    async def run(self):
+        async with httpx.AsyncClient(timeout=DASHBOARD_FETCH_TIMEOUT) as client:
+            while self._subscribers:
+                started = time.monotonic()
+                try:
+                    self.publish(await self.collect(client))
+                except Exception as e:
+                    logger.error(f"Ошибка сбора счётчиков панели: {e}")
+                await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+        # Зрителей нет - при следующем запуске снимок и скорости считаются заново
+        self.snapshot = {}
+        self._totals.clear()
+        self._last_tick = None
+        self._task = None
+        # Кто-то подключился, пока закрывался клиент
+        if self._subscribers:
+            self._ensure_running()
+
+    def _ensure_running(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def events(self) -> AsyncGenerator[str, None]:
+        """SSE-поток для одного зрителя: сначала полный снимок, дальше изменения раз в тик"""
+        subscriber: asyncio.Queue = asyncio.Queue(maxsize=DASHBOARD_MAX_BACKLOG)
+        self._subscribers[subscriber] = not self.snapshot
+        self._ensure_running()
+        try:
+            if self.snapshot:
+                yield self._frame({"type": "snapshot", "time": time.time(), "values": self.snapshot})
+            while True:
+                yield await subscriber.get()
+        finally:
+            self._subscribers.pop(subscriber, None)
+
+    async def stop(self):
+        self._subscribers.clear()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+dashboard = Dashboard()
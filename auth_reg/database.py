@@ -1,4 +1,5 @@
 import asyncio
+import threading
 
 from tortoise import Tortoise, fields
 from tortoise.models import Model
@@ -6,15 +7,34 @@ from tortoise.transactions import in_transaction
 from contextlib import asynccontextmanager
 from typing import List, Dict, Any, Optional, AsyncGenerator
 import logging
-from passlib.context import CryptContext
+
+from metrics import Histogram
 
 
 logger = logging.getLogger(__name__)
 
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "Время запросов репозитория к БД", ["query"])
+PASSWORD_VERIFY_SECONDS = Histogram("password_verify_seconds", "Время pwd_context.verify")
+
 # Константы
 DB_URL = 'sqlite://{name_db}.db'
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+_pwd_context = None
+_pwd_context_lock = threading.Lock()
+
+
+def get_pwd_context():
+    """CryptContext (passlib + argon2) создаётся при старте в фоне или при первом обращении"""
+    global _pwd_context
+    if _pwd_context is None:
+        with _pwd_context_lock:
+            if _pwd_context is None:
+                from passlib.context import CryptContext
+                context = CryptContext(schemes=["argon2"], deprecated="auto")
+                # Первый hash подгружает argon2-бэкенд, пусть это случится здесь, а не в запросе
+                context.hash("warmup")
+                _pwd_context = context
+    return _pwd_context
 
 
 class DatabaseManager:
@@ -24,6 +44,10 @@ class DatabaseManager:
         self.db_name = db_name
         self.db_url = f'sqlite://{db_name}'
         self._initialized = False
+        # Сессии считаются: соединения закрывает только последняя активная,
+        # иначе параллельные запросы закрывали бы соединения друг у друга
+        self._active_sessions = 0
+        self._lock = asyncio.Lock()
 
     async def init_db(self):
         """Инициализация базы данных и подключение к ней"""
@@ -55,14 +79,23 @@ class DatabaseManager:
     @asynccontextmanager
     async def session(self):
         """Контекстный менеджер для сессии БД"""
+        async with self._lock:
+            self._active_sessions += 1
+            try:
+                await self.init_db()
+            except Exception:
+                self._active_sessions -= 1
+                raise
         try:
-            await self.init_db()
             yield
         except Exception as e:
             logger.error(f"Ошибка в сессии БД: {e}")
             raise
         finally:
-            await self.close_db()
+            async with self._lock:
+                self._active_sessions -= 1
+                if self._active_sessions == 0:
+                    await self.close_db()
 
     @asynccontextmanager
     async def transaction(self):
@@ -148,6 +181,7 @@ class UserRepository:
     """Репозиторий для работы с пользователями"""
 
     @staticmethod
+    @DB_QUERY_SECONDS.time(query="create_user")
     async def create_user(
             email: str,
             password: str,
@@ -167,7 +201,7 @@ class UserRepository:
                 last_name=last_name,
                 middle_name=middle_name,
                 position=position,
-                password=pwd_context.hash(password),
+                password=get_pwd_context().hash(password),
                 is_connecting_to_rooms=is_connecting_to_rooms,
                 is_creating_rooms=is_creating_rooms,
                 is_admin=is_admin
@@ -176,6 +210,7 @@ class UserRepository:
             return user
 
     @staticmethod
+    @DB_QUERY_SECONDS.time(query="create_defoult_admin")
     async def create_defoult_admin() -> User:
         """Создание дефолтного аккаунта админа"""
         async with db_manager.session():
@@ -192,7 +227,7 @@ class UserRepository:
                 last_name='Царь',
                 middle_name='Конференций',
                 position='Директор',
-                password=pwd_context.hash('admin1234'),
+                password=get_pwd_context().hash('admin1234'),
                 is_connecting_to_rooms=True,
                 is_creating_rooms=True,
                 is_admin=True
@@ -201,6 +236,7 @@ class UserRepository:
             return user
 
     @staticmethod
+    @DB_QUERY_SECONDS.time(query="get_user_by_id")
     async def get_user_by_id(user_id: int) -> Optional[User]:
         """Получение пользователя по ID"""
         async with db_manager.session():
@@ -208,6 +244,7 @@ class UserRepository:
             return user
 
     @staticmethod
+    @DB_QUERY_SECONDS.time(query="get_user_by_email")
     async def get_user_by_email(email: str) -> Optional[User]:
         """Получение пользователя по email"""
         async with db_manager.session():
@@ -215,13 +252,15 @@ class UserRepository:
             return user
 
     @staticmethod
+    @DB_QUERY_SECONDS.time(query="get_sign_user")
     async def get_sign_user(email: str, password: str) -> Dict[str, Any]:
         async with db_manager.session():
             response_user = await User.filter(email=email).first()
             if response_user is None:
                 return {'status': False, 'response': 'Email не найден', 'user': None}
 
-            true_password = pwd_context.verify(password, response_user.password)
+            with PASSWORD_VERIFY_SECONDS.time():
+                true_password = get_pwd_context().verify(password, response_user.password)
             if not true_password:
                 return {'status': False, 'response': 'Не верный пароль', 'user': None}
 
@@ -229,6 +268,7 @@ class UserRepository:
 
 
     @staticmethod
+    @DB_QUERY_SECONDS.time(query="get_all_users")
     async def get_all_users() -> List[User]:
         """Получение всех пользователей"""
         async with db_manager.session():
@@ -236,6 +276,7 @@ class UserRepository:
             return users
 
     @staticmethod
+    @DB_QUERY_SECONDS.time(query="update_user")
     async def update_user(user_id: int, **kwargs) -> Optional[User]:
         """Обновление данных пользователя"""
         async with db_manager.session():
@@ -247,6 +288,7 @@ class UserRepository:
             return None
 
     @staticmethod
+    @DB_QUERY_SECONDS.time(query="delete_user")
     async def delete_user(user_id: int) -> bool:
         """Удаление пользователя"""
         async with db_manager.session():
@@ -1,12 +1,16 @@
 import os
+import time
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
+from urllib.parse import quote
 
 import jwt
 from fastapi import Request, HTTPException, status
 from pydantic import BaseModel
 from starlette.middleware.base import BaseHTTPMiddleware
 
+from metrics import AUTH_MIDDLEWARE_SECONDS, JWT_DECODE_SECONDS
+
 # ---- Настройки (вынеси в env в проде) ----
 JWT_SECRET = os.getenv("JWT_SECRET", "changeme_super_secret")
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
@@ -15,6 +19,10 @@ REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 30))
 COOKIE_DOMAIN = os.getenv("COOKIE_DOMAIN")
 ACCESS_COOKIE_NAME = os.getenv("ACCESS_COOKIE_NAME", "access_name")
 REFRESH_COOKIE_NAME = os.getenv("REFRESH_COOKIE_NAME", "refresh_name")
+# Путь проверки токена для nginx auth_request: AuthMiddleware его не обрабатывает
+VERIFY_PATH = "/verify"
+# Сколько gateway кэширует положительный ответ /verify (но не дольше срока токена)
+VERIFY_CACHE_SECONDS = int(os.getenv("VERIFY_CACHE_SECONDS", 30))
 
 
 # ---- Schemas ----
@@ -59,16 +67,59 @@ def decode_token(token: str):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="token_invalid")
 
 
+def verify_access_token(token: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Payload действующего access-токена или None - без похода за refresh и без исключений"""
+    if not token:
+        return None
+    try:
+        with JWT_DECODE_SECONDS.time():
+            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.PyJWTError:
+        return None
+    if payload.get("type") != "access" or not payload.get("email"):
+        return None
+    return payload
+
+
+def verify_cache_seconds(payload: Dict[str, Any]) -> int:
+    """Время жизни ответа /verify в кэше gateway: кэш не должен пережить exp токена"""
+    expires = payload.get("exp")
+    if expires is None:
+        return VERIFY_CACHE_SECONDS
+    return max(0, min(VERIFY_CACHE_SECONDS, int(expires - time.time())))
+
+
+def identity_headers(payload: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Личность пользователя для сервисов за gateway.
+    Заголовки только latin-1, поэтому текстовые поля закодированы как в URL.
+    """
+    return {
+        "X-User-Id": str(payload.get("id") or ""),
+        "X-User-Email": quote(payload.get("email", "")),
+        "X-User-Last-Name": quote(payload.get("last_name") or ""),
+        "X-User-First-Name": quote(payload.get("first_name") or ""),
+        "X-User-Middle-Name": quote(payload.get("middle_name") or ""),
+        "X-User-Admin": "1" if payload.get("is_admin", False) else "0",
+    }
+
+
 # ---- Middleware: ставим request.state.user для шаблонов/роутов ----
 class AuthMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
+        if request.url.path == VERIFY_PATH:
+            # /verify сам проверяет токен, второй раз декодировать незачем
+            return await call_next(request)
+
+        started = time.perf_counter()
         request.state.user = None
         token = request.cookies.get(ACCESS_COOKIE_NAME)
 
         if token:
             try:
                 # Пытаемся декодировать access token
-                payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+                with JWT_DECODE_SECONDS.time():
+                    payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
                 if payload.get("type") == "access":
                     request.state.user = payload
 
@@ -97,6 +148,7 @@ class AuthMiddleware(BaseHTTPMiddleware):
                 # Любая другая ошибка декодирования
                 request.state.user = None
 
+        AUTH_MIDDLEWARE_SECONDS.observe(time.perf_counter() - started)
         response = await call_next(request)
         return response
 
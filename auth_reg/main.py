@@ -1,22 +1,52 @@
+from startup import startup_report, LazyTemplates, install_startup
+
 import logging
 from pathlib import Path
 
-from fastapi import FastAPI, Request, Form, HTTPException, Depends, Response
-from fastapi.middleware import Middleware
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from starlette.status import HTTP_303_SEE_OTHER
+with startup_report.measure("fastapi"):
+    from fastapi import FastAPI, Request, Form, HTTPException, Depends, Response
+    from fastapi.middleware import Middleware
+    from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
+    from fastapi.staticfiles import StaticFiles
+    from starlette.status import HTTP_303_SEE_OTHER
 
-from database import UserRepository
+with startup_report.measure("database"):
+    from database import UserRepository, get_pwd_context
 
 user_repository = UserRepository()
 
-from jwtapi import *
+with startup_report.measure("service modules"):
+    from jwtapi import *
+
+    from dashboard import AUTH_LOGINS, dashboard
+    from metrics import MetricsMiddleware, metrics_endpoint
+    from profiling import ProfilingMiddleware, install_profiling
+    from logconfig import setup_logging, stop_logging
+
+app = FastAPI(
+    title="Система регистрации",
+    version="1.0.0",
+    middleware=[Middleware(MetricsMiddleware), Middleware(AuthMiddleware), Middleware(ProfilingMiddleware)]
+)
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+install_profiling(app)
+install_startup(app)
+
+setup_logging("auth_reg.log")
+
+
+@app.on_event("startup")
+async def on_startup():
+    # argon2 и jinja2 поднимаются в потоках, /ready ответит 200 после их готовности
+    startup_report.build_in_background("password hashing", get_pwd_context)
+    startup_report.build_in_background("templates", templates.load)
+    startup_report.finish_startup()
 
-app = FastAPI(title="Система регистрации", version="1.0.0", middleware=[Middleware(AuthMiddleware)])
 
-logging.basicConfig(filename="auth_reg.log", level=logging.INFO)
+@app.on_event("shutdown")
+async def on_shutdown():
+    await dashboard.stop()
+    stop_logging()
 
 # Получаем абсолютный путь к директории проекта
 BASE_DIR = Path(__file__).parent
@@ -24,8 +54,8 @@ BASE_DIR = Path(__file__).parent
 # Подключаем статические файлы с абсолютными путями
 app.mount("/static", StaticFiles(directory=BASE_DIR / "static"), name="static")
 
-# Подключаем шаблоны
-templates = Jinja2Templates(directory=BASE_DIR / "templates")
+# Подключаем шаблоны (jinja2 импортируется при старте в фоне)
+templates = LazyTemplates(BASE_DIR / "templates")
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -65,6 +95,18 @@ async def home(request: Request, current_user_data: dict = Depends(get_current_u
     )
 
 
+# SSE-поток живой панели администратора (счётчики chat_main, rooms и auth_reg)
+@app.get("/dashboard/stream")
+async def dashboard_stream(current_user_data: dict = Depends(get_current_user)):
+    if not current_user_data.get('is_admin', False):
+        raise HTTPException(status_code=403, detail="Admin only")
+    return StreamingResponse(
+        dashboard.events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/create_room", response_class=HTMLResponse)
 async def index(request: Request, current_user_data: dict = Depends(get_current_user)):
     if not current_user_data.get('is_admin', False):
@@ -184,11 +226,13 @@ async def sign_user(
 
         response_user = await user_repository.get_sign_user(email, password)
         if not response_user['status']:
+            AUTH_LOGINS.inc(result="failed")
             raise HTTPException(status_code=400, detail=response_user['response'])
 
         user_record = response_user['user']
 
         token_data = {
+            'id': user_record.id,
             'email': user_record.email,
             'first_name': user_record.first_name,
             'last_name': user_record.last_name,
@@ -199,6 +243,7 @@ async def sign_user(
 
         access_token = create_access_token(token_data)
         refresh_token = create_refresh_token(token_data)
+        AUTH_LOGINS.inc(result="ok")
 
         response = RedirectResponse(url="/auth/homepage", status_code=HTTP_303_SEE_OTHER)
 
@@ -306,6 +351,22 @@ async def refresh(request: Request, response: Response):
     return {"status": "ok"}
 
 
+@app.get(VERIFY_PATH, include_in_schema=False)
+async def verify(request: Request):
+    """
+    Проверка access-токена для nginx auth_request.
+    200 и X-User-* - токен действует, 401 - нет (без редиректа на /auth:
+    auth_request понимает только 2xx, 401 и 403). gateway кэширует ответ по токену,
+    X-Accel-Expires не даёт кэшу пережить срок действия токена (0 - не кэшировать).
+    """
+    payload = verify_access_token(request.cookies.get(ACCESS_COOKIE_NAME))
+    if payload is None:
+        return Response(status_code=401)
+    headers = identity_headers(payload)
+    headers["X-Accel-Expires"] = str(verify_cache_seconds(payload))
+    return Response(status_code=200, headers=headers)
+
+
 # Страница списка пользователей
 @app.get("/users", response_class=HTMLResponse)
 async def users_list(request: Request):
@@ -0,0 +1,165 @@
+# Общий модуль сервисов: одинаковые копии в chat_main, rooms и auth_reg, потому что
+# у каждого сервиса свой docker build context. Правится во всех трёх сразу,
+# расхождение ловит python tools/check_shared.py
+import asyncio
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Dict, Optional
+
+from fastapi import HTTPException, Query, Request
+from starlette.responses import PlainTextResponse
+
+# Ограничения на профилирование по запросу админа
+PROFILE_MAX_SECONDS = 60
+PROFILE_DEFAULT_INTERVAL = 0.005
+# Сколько последних профилей отдельных запросов хранить в памяти
+PROFILE_KEEP_REQUESTS = 20
+PROFILE_HEADER = "x-profile"
+
+
+class StackSampler:
+    """
+    Сэмплирующий профилировщик на отдельном потоке.
+
+    Раз в interval снимает стеки через sys._current_frames() и копит их
+    в формате folded stacks ("a;b;c N"), который понимают flamegraph.pl и speedscope.
+    Профилируемый код не инструментируется, поэтому накладные расходы
+    определяются только частотой сэмплов.
+    """
+
+    def __init__(self, interval: float = PROFILE_DEFAULT_INTERVAL, thread_id: Optional[int] = None):
+        self.interval = interval
+        # Если задан - сэмплируем только этот поток (например, поток event loop)
+        self.thread_id = thread_id
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _fold(frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id or (self.thread_id is not None and thread_id != self.thread_id):
+                continue
+            self.stacks[self._fold(frame)] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+_profile_lock = asyncio.Lock()
+_request_profiles: "OrderedDict[str, str]" = OrderedDict()
+
+
+def require_admin(request: Request) -> Dict:
+    """Доступ только по claim is_admin из JWT (его кладёт AuthMiddleware)"""
+    user = getattr(request.state, "user", None)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if not user.get("is_admin", False):
+        raise HTTPException(status_code=403, detail="Admin only")
+    return user
+
+
+async def profile_process(
+        request: Request,
+        seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+        interval: float = Query(PROFILE_DEFAULT_INTERVAL, ge=0.001, le=1),
+):
+    """Профиль всего процесса за seconds секунд в формате folded stacks"""
+    require_admin(request)
+    if _profile_lock.locked():
+        raise HTTPException(status_code=409, detail="Profiling already in progress")
+    async with _profile_lock:
+        sampler = StackSampler(interval)
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            sampler.stop()
+    return PlainTextResponse(sampler.folded(), headers={"X-Profile-Samples": str(sampler.samples)})
+
+
+async def get_request_profile(request: Request, profile_id: str):
+    require_admin(request)
+    folded = _request_profiles.get(profile_id)
+    if folded is None:
+        raise HTTPException(status_code=410, detail="Profile expired")
+    return PlainTextResponse(folded)
+
+
+class ProfilingMiddleware:
+    """
+    Профиль отдельного запроса по заголовку X-Profile: 1 (только для админов).
+
+    Сэмплируется поток event loop на время запроса, поэтому в профиль попадают
+    и конкурентные задачи. Результат доступен по /debug/profile/{id},
+    id возвращается в заголовке X-Profile-Id.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._requested(scope):
+            return await self.app(scope, receive, send)
+
+        profile_id = uuid.uuid4().hex
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        sampler = StackSampler(PROFILE_DEFAULT_INTERVAL, thread_id=threading.get_ident())
+        sampler.start()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.stop()
+            header = f"# {scope['method']} {scope['path']} {time.perf_counter() - started:.6f}s\n"
+            _request_profiles[profile_id] = header + sampler.folded()
+            while len(_request_profiles) > PROFILE_KEEP_REQUESTS:
+                _request_profiles.popitem(last=False)
+
+    @staticmethod
+    def _requested(scope) -> bool:
+        for key, value in scope["headers"]:
+            if key == PROFILE_HEADER.encode() and value in (b"1", b"true"):
+                user = scope.get("state", {}).get("user")
+                return bool(user and user.get("is_admin", False))
+        return False
+
+
+def install_profiling(app):
+    """Маршруты профилировщика; ProfilingMiddleware подключается после AuthMiddleware"""
+    app.add_api_route("/debug/profile", profile_process, methods=["GET"], include_in_schema=False)
+    app.add_api_route("/debug/profile/{profile_id}", get_request_profile, methods=["GET"], include_in_schema=False)
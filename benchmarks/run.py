@@ -0,0 +1,322 @@
+"""
+Локальный нагрузочный бенчмарк сервисов chat_main, auth_reg и rooms.
+
+Каждый сервис поднимается через uvicorn на 127.0.0.1 в отдельном процессе,
+рабочая директория - временная папка (БД создаются в ней и удаляются после прогона).
+Сеть и внешние сервисы не нужны, результат - JSON для сравнения между прогонами.
+
+Пример:
+    python benchmarks/run.py --scenario all --clients 50 --rooms 5 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+import jwt
+from websockets.asyncio.client import connect
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+JWT_SECRET = "bench_secret"
+JWT_ALGORITHM = "HS256"
+ACCESS_COOKIE_NAME = "access_token"
+REFRESH_COOKIE_NAME = "refresh_token"
+
+ADMIN_EMAIL = "Admin@gmail.com"
+ADMIN_PASSWORD = "admin1234"
+
+# Таймаут одного HTTP-запроса: под штормом логинов argon2 отвечает секундами
+HTTP_TIMEOUT = 60
+# Сколько ждать подключения всех клиентов чата и доставки эха
+CHAT_TIMEOUT = 30
+
+# Сервис готов, когда /ready отвечает 200 (фоновая инициализация завершена)
+READY_PATH = "/ready"
+
+
+# ---------- Статистика ----------
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, float]:
+    """Сводка по задержкам (в миллисекундах) и пропускной способности"""
+    ms = [value * 1000 for value in latencies]
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p95_ms": round(percentile(ms, 95), 3),
+        "p99_ms": round(percentile(ms, 99), 3),
+        "max_ms": round(max(ms), 3) if ms else 0.0,
+    }
+
+
+# ---------- Запуск сервисов ----------
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def make_token(email: str = ADMIN_EMAIL, is_admin: bool = True, **extra) -> str:
+    payload = {
+        "type": "access",
+        "email": email,
+        "first_name": "Бенч",
+        "last_name": "Тестов",
+        "middle_name": "Нагрузочный",
+        "position": "bench",
+        "is_admin": is_admin,
+        "exp": int(time.time()) + 3600,
+        **extra,
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+
+@asynccontextmanager
+async def run_service(name: str):
+    """Поднимает сервис на свободном порту и возвращает его базовый URL"""
+    port = free_port()
+    env = {
+        **os.environ,
+        "JWT_SECRET": JWT_SECRET,
+        "JWT_ALGORITHM": JWT_ALGORITHM,
+        "ACCESS_COOKIE_NAME": ACCESS_COOKIE_NAME,
+        "REFRESH_COOKIE_NAME": REFRESH_COOKIE_NAME,
+    }
+    with tempfile.TemporaryDirectory(prefix=f"bench_{name}_") as workdir:
+        process = subprocess.Popen(
+            [
+                sys.executable, "-m", "uvicorn", "main:app",
+                "--app-dir", str(REPO_DIR / name),
+                "--host", "127.0.0.1", "--port", str(port),
+                "--log-level", "warning",
+            ],
+            cwd=workdir,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        base_url = f"http://127.0.0.1:{port}"
+        try:
+            async with httpx.AsyncClient(base_url=base_url) as client:
+                for _ in range(200):
+                    if process.poll() is not None:
+                        raise RuntimeError(f"{name} не запустился: {process.stderr.read().decode()}")
+                    try:
+                        response = await client.get(READY_PATH)
+                        if response.status_code == 200:
+                            break
+                    except httpx.TransportError:
+                        pass
+                    await asyncio.sleep(0.05)
+                else:
+                    raise RuntimeError(f"{name} не ответил за 10 секунд")
+            yield base_url
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+# ---------- Сценарии ----------
+async def bench_chat(clients: int, rooms: int, messages: int) -> Dict:
+    """N WebSocket-клиентов в M комнатах, задержка = отправка -> получение своего эха"""
+    async with run_service("chat_main") as base_url:
+        ws_url = base_url.replace("http://", "ws://") + "/ws"
+        latencies: List[float] = []
+        errors = 0
+        connected = asyncio.Event()
+        finished = asyncio.Event()
+        ready = 0
+        completed = 0
+
+        async def chat_client(index: int):
+            nonlocal errors, ready, completed
+            token = make_token(email=f"user{index}@bench", is_admin=False)
+            room = f"room{index % rooms}"
+            async with connect(
+                f"{ws_url}?room={room}",
+                additional_headers={"Cookie": f"{ACCESS_COOKIE_NAME}={token}"},
+                max_queue=None,
+            ) as websocket:
+                pending: Dict[str, float] = {}
+                done = asyncio.Event()
+
+                async def reader():
+                    async for frame in websocket:
+                        text = json.loads(frame).get("text", "")
+                        sent_at = pending.pop(text, None)
+                        if sent_at is not None:
+                            latencies.append(time.perf_counter() - sent_at)
+                            if not pending and sent_count == messages:
+                                done.set()
+
+                reader_task = asyncio.create_task(reader())
+                ready += 1
+                if ready == clients:
+                    connected.set()
+                await asyncio.wait_for(connected.wait(), timeout=CHAT_TIMEOUT)
+
+                sent_count = 0
+                for number in range(messages):
+                    text = f"bench {index} {number}"
+                    pending[text] = time.perf_counter()
+                    sent_count += 1
+                    await websocket.send(text)
+                try:
+                    await asyncio.wait_for(done.wait(), timeout=CHAT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    errors += len(pending)
+                # Не отключаемся раньше остальных, чтобы не менять состав комнаты посреди замера
+                completed += 1
+                if completed == clients:
+                    finished.set()
+                try:
+                    await asyncio.wait_for(finished.wait(), timeout=CHAT_TIMEOUT)
+                finally:
+                    reader_task.cancel()
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(chat_client(i) for i in range(clients)), return_exceptions=True)
+        elapsed = time.perf_counter() - started
+        errors += sum(1 for result in results if isinstance(result, Exception))
+        return {
+            "scenario": "chat_ws",
+            "clients": clients,
+            "rooms": rooms,
+            "messages_per_client": messages,
+            **summarize(latencies, errors, elapsed),
+        }
+
+
+async def bench_login(clients: int, requests_per_client: int) -> Dict:
+    """Шторм логинов в /sign дефолтным админом (argon2 verify на каждый запрос)"""
+    async with run_service("auth_reg") as base_url:
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            # Главная создаёт дефолтного админа
+            await client.get("/")
+
+        latencies: List[float] = []
+        errors = 0
+
+        async def login_client():
+            nonlocal errors
+            async with httpx.AsyncClient(base_url=base_url, timeout=HTTP_TIMEOUT) as client:
+                for _ in range(requests_per_client):
+                    started = time.perf_counter()
+                    try:
+                        response = await client.post("/sign", data={"email": ADMIN_EMAIL, "password": ADMIN_PASSWORD})
+                    except httpx.HTTPError:
+                        errors += 1
+                        continue
+                    if response.status_code == 303:
+                        latencies.append(time.perf_counter() - started)
+                    else:
+                        errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(login_client() for _ in range(clients)))
+        return {
+            "scenario": "auth_login",
+            "clients": clients,
+            **summarize(latencies, errors, time.perf_counter() - started),
+        }
+
+
+async def bench_rooms(clients: int, rooms: int, requests_per_client: int) -> Dict:
+    """Polling /room_exists по существующим комнатам"""
+    async with run_service("rooms") as base_url:
+        cookies = {ACCESS_COOKIE_NAME: make_token()}
+        async with httpx.AsyncClient(base_url=base_url, cookies=cookies) as client:
+            response = await client.post(
+                "/bulk/create_rooms",
+                json={"rooms": [{"title": f"bench {i}"} for i in range(rooms)]},
+            )
+            response.raise_for_status()
+            codes = [item["code"] for item in response.json()["results"]]
+
+        latencies: List[float] = []
+        errors = 0
+
+        async def poll_client(index: int):
+            nonlocal errors
+            async with httpx.AsyncClient(base_url=base_url, timeout=HTTP_TIMEOUT) as client:
+                for number in range(requests_per_client):
+                    code = codes[(index + number) % len(codes)]
+                    started = time.perf_counter()
+                    try:
+                        response = await client.get(f"/room_exists/{code}")
+                    except httpx.HTTPError:
+                        errors += 1
+                        continue
+                    if response.status_code == 200 and response.json().get("exists"):
+                        latencies.append(time.perf_counter() - started)
+                    else:
+                        errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(poll_client(i) for i in range(clients)))
+        return {
+            "scenario": "rooms_poll",
+            "clients": clients,
+            "rooms": rooms,
+            **summarize(latencies, errors, time.perf_counter() - started),
+        }
+
+
+async def main(args):
+    results = []
+    if args.scenario in ("chat", "all"):
+        results.append(await bench_chat(args.clients, args.rooms, args.requests))
+    if args.scenario in ("auth", "all"):
+        results.append(await bench_login(args.clients, args.requests))
+    if args.scenario in ("rooms", "all"):
+        results.append(await bench_rooms(args.clients, args.rooms, args.requests))
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    print(output)
+
+    # Задержки, посчитанные по горстке успешных запросов из множества упавших, ничего не значат
+    failed = [result["scenario"] for result in results if result["errors"]]
+    if failed:
+        print(f"Сценарии с ошибками запросов: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальный бенчмарк сервисов BadZoom")
+    parser.add_argument("--scenario", choices=["chat", "auth", "rooms", "all"], default="all")
+    parser.add_argument("--clients", type=int, default=20, help="число параллельных клиентов")
+    parser.add_argument("--rooms", type=int, default=4, help="число комнат")
+    parser.add_argument("--requests", type=int, default=20, help="сообщений/запросов на клиента")
+    parser.add_argument("--output", help="куда сохранить JSON с результатами")
+    asyncio.run(main(parser.parse_args()))
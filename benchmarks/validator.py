@@ -0,0 +1,129 @@
+"""
+Микробенчмарк проверки банвордов chat_main в одном процессе, без сети.
+
+Сравнивает текущий validate_message (нормализация + один проход автомата)
+с прежней схемой (lower() + проход автомата по исходным словам) на одном
+и том же наборе сообщений. Сравнение идёт без кэша проверок, отдельно
+меряется проход с кэшем (в наборе много повторов, как в живом чате).
+Если новая схема без кэша медленнее больше чем в --max-slowdown раз,
+скрипт завершается с кодом 1.
+
+Пример:
+    python benchmarks/validator.py --messages 20000 --output validator.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import sys
+import time
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR / "chat_main"))
+
+import ahocorasick  # noqa: E402
+
+from validator.processor import (  # noqa: E402
+    ALLOWED_RE, load_automaton, load_banwords, validate_message, validation_cache,
+)
+
+CLEAN = [
+    "привет всем", "ок", "+", "да", "сейчас подключусь", "слышно плохо, перезайди",
+    "https://example.com/docs/meeting-notes", "давайте начнём через 5 минут",
+    "у меня всё работает, проверь микрофон", "Hello, can you hear me?",
+    "скинь ссылку на презентацию пожалуйста", "спасибо, до завтра!",
+]
+OBFUSCATED = ["х.у.й", "xyй", "6ля", "FUCK", "б-л-я-д-ь", "s.p.a.m"]
+
+
+def make_messages(count: int, dirty_share: float, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        text = " ".join(rng.choice(CLEAN) for _ in range(rng.randint(1, 4)))
+        if rng.random() < dirty_share:
+            text += " " + rng.choice(OBFUSCATED)
+        messages.append(text)
+    return messages
+
+
+def build_baseline_automaton(words):
+    automaton = ahocorasick.Automaton()
+    for word in words:
+        automaton.add_word(word, word)
+    automaton.make_automaton()
+    return automaton
+
+
+async def baseline_validate(automaton, text: str):
+    """Прежняя проверка: только lower(), без нормализации"""
+    await asyncio.sleep(0)
+    text = text.strip()
+    if not text or not ALLOWED_RE.match(text):
+        return False, text
+    lowered = text.lower()
+    censored = list(text)
+    is_correct = True
+    for i, found in automaton.iter(lowered):
+        is_correct = False
+        censored[(i + 1) - len(found):(i + 1)] = "*" * len(found)
+    return is_correct, "".join(censored)
+
+
+async def measure(check, messages, rounds: int) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for text in messages:
+            await check(text)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+async def main(args):
+    messages = make_messages(args.messages, args.dirty_share)
+    baseline_automaton = build_baseline_automaton(load_banwords())
+    load_automaton()
+
+    baseline = await measure(lambda text: baseline_validate(baseline_automaton, text), messages, args.rounds)
+    cache_size = validation_cache.maxsize
+    validation_cache.maxsize = 0
+    current = await measure(validate_message, messages, args.rounds)
+    validation_cache.maxsize = cache_size
+    cached = await measure(validate_message, messages, args.rounds)
+
+    caught_before = caught_now = 0
+    for text in OBFUSCATED:
+        caught_before += not (await baseline_validate(baseline_automaton, text))[0]
+        caught_now += not (await validate_message(text))[0]
+
+    slowdown = current / baseline
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "messages": len(messages),
+        "baseline_msgs_per_s": round(len(messages) / baseline, 1),
+        "current_msgs_per_s": round(len(messages) / current, 1),
+        "cached_msgs_per_s": round(len(messages) / cached, 1),
+        "slowdown": round(slowdown, 3),
+        "obfuscated_caught_before": f"{caught_before}/{len(OBFUSCATED)}",
+        "obfuscated_caught_now": f"{caught_now}/{len(OBFUSCATED)}",
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    print(output)
+    return 0 if slowdown <= args.max_slowdown else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк проверки банвордов")
+    parser.add_argument("--messages", type=int, default=20000, help="число сообщений в наборе")
+    parser.add_argument("--rounds", type=int, default=5, help="прогонов, берётся лучший")
+    parser.add_argument("--dirty-share", type=float, default=0.1, help="доля сообщений с банвордами")
+    parser.add_argument("--max-slowdown", type=float, default=2.0, help="допустимое замедление")
+    parser.add_argument("--output", help="куда сохранить JSON с результатами")
+    sys.exit(asyncio.run(main(parser.parse_args())))
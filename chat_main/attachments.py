@@ -0,0 +1,132 @@
+import asyncio
+import hashlib
+import os
+import secrets
+from pathlib import Path
+from typing import AsyncIterator, Dict, Tuple
+
+from metrics import Counter
+
+# Файлы хранятся по sha256 содержимого: одинаковые загрузки лежат на диске один раз
+ATTACHMENTS_DIR = Path(os.getenv("ATTACHMENTS_DIR", "attachments"))
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", 50 * 1024 * 1024))
+MAX_FILENAME_LENGTH = 255
+# Куски тела копятся до такого размера и пишутся на диск одним вызовом в потоке
+ATTACHMENT_WRITE_BUFFER = 1024 * 1024
+# Если задан - файл отдаёт nginx (X-Accel-Redirect на internal location, sendfile),
+# иначе FileResponse из приложения
+ATTACHMENTS_ACCEL_PREFIX = os.getenv("ATTACHMENTS_ACCEL_PREFIX", "")
+# Файлы уникальны по содержимому и никогда не меняются
+ATTACHMENT_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+# Эти типы безопасно показывать в браузере, остальные - только скачиванием
+INLINE_CONTENT_TYPES = {
+    "image/png", "image/jpeg", "image/gif", "image/webp",
+    "audio/mpeg", "audio/ogg", "video/mp4", "video/webm",
+    "text/plain", "application/pdf",
+}
+
+CHAT_ATTACHMENT_BYTES = Counter("chat_attachment_bytes_total", "Принятые байты вложений")
+CHAT_ATTACHMENT_UPLOADS = Counter("chat_attachment_uploads_total", "Загрузки вложений", ["result"])
+
+
+class AttachmentTooLarge(Exception):
+    pass
+
+
+def new_attachment_id() -> str:
+    return secrets.token_urlsafe(16)
+
+
+def blob_relative_path(sha256: str) -> str:
+    # Два уровня каталогов, чтобы в одном не копились сотни тысяч файлов
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+def blob_path(sha256: str) -> Path:
+    return ATTACHMENTS_DIR / blob_relative_path(sha256)
+
+
+def _write(file, chunks) -> None:
+    file.write(b"".join(chunks))
+
+
+def _commit_blob(tmp_path: Path, sha256: str) -> bool:
+    """Переносит загруженный файл на место по хешу. False - такой файл уже был"""
+    path = blob_path(sha256)
+    if path.exists():
+        tmp_path.unlink()
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # rename в пределах одного каталога атомарен: читатели не увидят недописанный файл
+    os.replace(tmp_path, path)
+    return True
+
+
+async def store_upload(chunks: AsyncIterator[bytes], max_bytes: int = ATTACHMENT_MAX_BYTES) -> Tuple[str, int]:
+    """
+    Пишет тело загрузки на диск по мере прихода, считая sha256 на лету.
+    В памяти - не больше ATTACHMENT_WRITE_BUFFER, сколько бы ни весил файл.
+    Возвращает (sha256, размер); AttachmentTooLarge - если тело длиннее max_bytes.
+    """
+    tmp_dir = ATTACHMENTS_DIR / "tmp"
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = tmp_dir / new_attachment_id()
+
+    hasher = hashlib.sha256()
+    size = 0
+    buffer, buffered = [], 0
+    file = await asyncio.to_thread(open, tmp_path, "wb")
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_bytes:
+                raise AttachmentTooLarge()
+            hasher.update(chunk)
+            buffer.append(chunk)
+            buffered += len(chunk)
+            if buffered >= ATTACHMENT_WRITE_BUFFER:
+                await asyncio.to_thread(_write, file, buffer)
+                buffer, buffered = [], 0
+        if buffer:
+            await asyncio.to_thread(_write, file, buffer)
+    except BaseException:
+        file.close()
+        tmp_path.unlink(missing_ok=True)
+        CHAT_ATTACHMENT_UPLOADS.inc(result="rejected")
+        raise
+    await asyncio.to_thread(file.close)
+
+    sha256 = hasher.hexdigest()
+    created = await asyncio.to_thread(_commit_blob, tmp_path, sha256)
+    CHAT_ATTACHMENT_BYTES.inc(size)
+    CHAT_ATTACHMENT_UPLOADS.inc(result="stored" if created else "deduplicated")
+    return sha256, size
+
+
+def clean_filename(filename: str) -> str:
+    # Имя только для показа и Content-Disposition: без каталогов и управляющих символов
+    name = filename.replace("\\", "/").rsplit("/", 1)[-1]
+    name = "".join(ch for ch in name if ch.isprintable()).strip()
+    return name[:MAX_FILENAME_LENGTH] or "file"
+
+
+def attachment_headers(sha256: str) -> Dict[str, str]:
+    return {
+        "ETag": f'"{sha256}"',
+        "Cache-Control": ATTACHMENT_CACHE_CONTROL,
+        "X-Content-Type-Options": "nosniff",
+    }
+
+
+def etag_matches(if_none_match: str, sha256: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return f'"{sha256}"' in tags
+
+
+def disposition_type(content_type: str) -> str:
+    return "inline" if content_type in INLINE_CONTENT_TYPES else "attachment"
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import signal
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable
+
+from fastapi import WebSocket
+
+from hub import ClientConnection, StreamListener
+from metrics import Counter
+
+# Сколько ждать дописывания сообщений, которые уже в обработке
+DRAIN_TIMEOUT_SECONDS = float(os.getenv("DRAIN_TIMEOUT_SECONDS", 10))
+# Подсказка клиентам: переподключиться через MIN + случайное [0, SPREAD) мс
+DRAIN_RECONNECT_MIN_MS = int(os.getenv("DRAIN_RECONNECT_MIN_MS", 500))
+DRAIN_RECONNECT_SPREAD_MS = int(os.getenv("DRAIN_RECONNECT_SPREAD_MS", 5000))
+# Код закрытия "Service Restart" из RFC 6455
+CLOSE_SERVICE_RESTART = 1012
+
+CHAT_DRAINED_SOCKETS = Counter("chat_drained_sockets_total", "WebSocket, закрытые при drain")
+
+logger = logging.getLogger(__name__)
+
+
+def reconnect_delay_ms() -> int:
+    return DRAIN_RECONNECT_MIN_MS + random.randrange(max(DRAIN_RECONNECT_SPREAD_MS, 1))
+
+
+def reconnect_frame() -> str:
+    return json.dumps({"type": "reconnect", "after_ms": reconnect_delay_ms()})
+
+
+async def send_reconnect_hint(websocket: WebSocket):
+    """
+    Подсказка и закрытие для сокета, у которого ещё нет задачи-писателя (новый /ws во время drain).
+    Зарегистрированные в хабе сокеты закрываются через ClientConnection.finish.
+    """
+    try:
+        await websocket.send_text(reconnect_frame())
+        await websocket.close(code=CLOSE_SERVICE_RESTART, reason="Server restarting")
+    except Exception:
+        pass
+
+
+class ConnectionDrainer:
+    """
+    Плавная остановка чата перед выключением процесса.
+
+    По SIGTERM: перестаём принимать новые /ws, каждому клиенту отправляем
+    подсказку "переподключись через N мс" со случайным разбросом и закрываем
+    сокет (SSE-потокам - retry с тем же разбросом и конец потока), затем ждём, пока сохранятся сообщения, которые уже в обработке.
+    Только после этого управление отдаётся штатной остановке uvicorn - иначе
+    он сам рвёт все сокеты кодом 1012 и клиенты приходят на новый инстанс разом.
+    """
+
+    def __init__(self):
+        self.draining = False
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task = None
+
+    @contextmanager
+    def write(self):
+        """Обработка одного сообщения: drain дождётся её завершения"""
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._idle.set()
+
+    async def drain(self, clients: Dict[WebSocket, ClientConnection], streams: Iterable[StreamListener] = ()):
+        self.draining = True
+        connections = list(clients.values())
+        streams = list(streams)
+        logger.info(
+            "Drain started", extra={"sockets": len(connections), "streams": len(streams), "in_flight": self._in_flight}
+        )
+
+        for listener in streams:
+            listener.close(retry_ms=reconnect_delay_ms())
+        # Подсказка встаёт в очередь после уже отправляемых сообщений, закрывает сокет его писатель
+        for connection in connections:
+            connection.finish(CLOSE_SERVICE_RESTART, "Server restarting", reconnect_frame())
+        if connections:
+            await asyncio.wait(
+                [asyncio.ensure_future(connection.wait_finished()) for connection in connections],
+                timeout=DRAIN_TIMEOUT_SECONDS,
+            )
+        CHAT_DRAINED_SOCKETS.inc(len(connections))
+
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=DRAIN_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            logger.error("Drain timeout, unsaved messages", extra={"in_flight": self._in_flight})
+        logger.info("Drain finished")
+
+    def install_signal_handler(
+            self, clients: Dict[WebSocket, ClientConnection], streams: Iterable[StreamListener] = (), on_start=None
+    ):
+        """
+        Перехватывает SIGTERM: сначала drain, потом прежний обработчик (uvicorn).
+        Повторный SIGTERM во время drain останавливает процесс сразу.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            # Обработчики сигналов ставятся только из главного потока (например, не в TestClient)
+            logger.warning("SIGTERM drain disabled: event loop is not in the main thread")
+            return
+        loop = asyncio.get_running_loop()
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def shutdown(signum, frame):
+            if callable(previous):
+                previous(signum, frame)
+            else:
+                signal.signal(signum, previous)
+                signal.raise_signal(signum)
+
+        async def drain_then_shutdown(signum, frame):
+            try:
+                await self.drain(clients, streams)
+            finally:
+                shutdown(signum, frame)
+
+        def handler(signum, frame):
+            if self.draining:
+                shutdown(signum, frame)
+                return
+            self.draining = True
+            if on_start is not None:
+                on_start()
+            loop.call_soon_threadsafe(start_drain, signum, frame)
+
+        def start_drain(signum, frame):
+            self._task = loop.create_task(drain_then_shutdown(signum, frame))
+
+        signal.signal(signal.SIGTERM, handler)
+
+
+drainer = ConnectionDrainer()
@@ -0,0 +1,112 @@
+import csv
+import io
+import json
+import os
+import zlib
+from typing import Dict, Iterable, Iterator
+
+from metrics import Counter
+from retention import MESSAGE_COLUMNS, archive_months, message_record, read_archive
+
+# Сколько строк читать из БД за одну короткую транзакцию
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+# Размер куска, который уходит клиенту
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+CSV_COLUMNS = ["id", "htmlid", "sender", "text", "room", "visibility", "time", "attachment"]
+
+CHAT_EXPORTED_MESSAGES = Counter("chat_exported_messages_total", "Сообщения, отданные в выгрузках", ["format"])
+
+
+def init_export(engine):
+    """Индекс под постраничное чтение комнаты по id (им же пользуется загрузка истории)"""
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_message_room_id ON message (room, id)")
+
+
+def iter_room_messages(engine, room: str, include_hidden: bool, include_archive: bool) -> Iterator[Dict]:
+    """
+    Вся история комнаты по порядку: сначала архивы по месяцам, затем messages.db.
+
+    БД читается keyset-пагинацией (id > последний) короткими транзакциями:
+    долгий курсор держал бы SHARED-блокировку SQLite и задерживал запись сообщений чата.
+    """
+    if include_archive:
+        for month in archive_months(room):
+            for record in read_archive(room, month):
+                if include_hidden or record["visibility"]:
+                    yield record
+
+    # Условие совпадает с частичным индексом ix_message_visible_room_id
+    visibility = "" if include_hidden else "AND visibility = 1 "
+    last_id = 0
+    while True:
+        with engine.connect() as connection:
+            rows = connection.exec_driver_sql(
+                f"SELECT {MESSAGE_COLUMNS} FROM message WHERE room = ? AND id > ? {visibility}"
+                f"ORDER BY id LIMIT ?",
+                (room, last_id, EXPORT_BATCH_SIZE),
+            ).all()
+        for row in rows:
+            yield message_record(row)
+        if len(rows) < EXPORT_BATCH_SIZE:
+            return
+        last_id = rows[-1].id
+
+
+def _ndjson_lines(records: Iterable[Dict]) -> Iterator[str]:
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def _csv_lines(records: Iterable[Dict]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS)
+    writer.writeheader()
+    for record in records:
+        # В CSV от вложения остаётся только id для /attachments/{id}
+        writer.writerow({**record, "attachment": (record.get("attachment") or {}).get("id", "")})
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_export(records: Iterable[Dict], export_format: str, compress: bool) -> Iterator[bytes]:
+    """
+    Кодирует записи в NDJSON/CSV и отдаёт кусками по EXPORT_CHUNK_BYTES,
+    при compress - одним gzip-потоком. Память не зависит от размера комнаты.
+    """
+    count = 0
+
+    def counted():
+        nonlocal count
+        for record in records:
+            count += 1
+            yield record
+
+    lines = _csv_lines(counted()) if export_format == "csv" else _ndjson_lines(counted())
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    chunk = []
+    size = 0
+    for line in lines:
+        data = line.encode("utf-8")
+        if compressor is not None:
+            data = compressor.compress(data)
+        if data:
+            chunk.append(data)
+            size += len(data)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield b"".join(chunk)
+            chunk, size = [], 0
+
+    if compressor is not None:
+        chunk.append(compressor.flush())
+    if chunk:
+        yield b"".join(chunk)
+    CHAT_EXPORTED_MESSAGES.inc(count, format=export_format)
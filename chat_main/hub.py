@@ -0,0 +1,392 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Set
+
+from fastapi import WebSocket
+
+from metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+# Как часто рассылать накопленные изменения состояния (typing/presence) по комнате
+EPHEMERAL_FLUSH_MS = int(os.getenv("EPHEMERAL_FLUSH_MS", 250))
+# Без повторного typing состояние "печатает" сбрасывается через столько секунд
+TYPING_TIMEOUT_SECONDS = float(os.getenv("TYPING_TIMEOUT_SECONDS", 6))
+# Столько неотправленных сообщений у клиента - и он отключается как медленный
+CLIENT_MAX_BACKLOG = int(os.getenv("CLIENT_MAX_BACKLOG", 1000))
+# Код закрытия "Try Again Later" из RFC 6455
+CLOSE_TRY_AGAIN_LATER = 1013
+
+# Пустой комментарий в SSE-потоке, чтобы прокси не закрывали простаивающее соединение
+SSE_KEEPALIVE_SECONDS = 15
+
+# Сколько комнат можно слушать через один сокет
+MAX_SUBSCRIPTIONS = int(os.getenv("CHAT_MAX_SUBSCRIPTIONS", 20))
+
+# Типы эфемерных событий от клиента: не сохраняются и не проходят валидатор
+EPHEMERAL_TYPES = {"typing", "stop_typing"}
+# Управляющие кадры мультиплексирования комнат
+CONTROL_TYPES = {"subscribe", "unsubscribe", "message"}
+
+CHAT_CONNECTED_SOCKETS = Gauge("chat_connected_sockets", "Подключённые WebSocket по комнатам", ["room"])
+CHAT_STREAM_LISTENERS = Gauge("chat_stream_listeners", "Читатели комнат через SSE", ["room"])
+CHAT_EPHEMERAL_COALESCED = Counter(
+    "chat_ephemeral_coalesced_total", "Эфемерные обновления, схлопнутые до отправки (не ушли отдельным кадром)"
+)
+CHAT_SLOW_CONSUMERS = Counter("chat_slow_consumers_total", "Клиенты, отключённые из-за переполненной очереди")
+
+
+def sse_frame(data: str, event_id: Optional[str] = None) -> str:
+    # Кадры - JSON в одну строку, переводов строк внутри data нет
+    if event_id is None:
+        return f"data: {data}\n\n"
+    return f"id: {event_id}\ndata: {data}\n\n"
+
+
+class ClientConnection:
+    """
+    Исходящий канал одного WebSocket: очередь сообщений и отдельная задача-писатель.
+
+    Рассылка только кладёт кадр в очередь и не ждёт медленного клиента.
+    Эфемерное состояние не стоит в очереди: изменения сливаются в один
+    словарь и уходят, только когда очередь сообщений пуста - при нехватке
+    полосы отбрасываются промежуточные состояния, а не сообщения.
+    """
+
+    def __init__(self, websocket: WebSocket, user_key: str, user_name: str):
+        self.websocket = websocket
+        self.user_key = user_key
+        self.user_name = user_name
+        # Подписки в порядке оформления: первая - комната по умолчанию для простого текста
+        self.rooms: Dict[str, None] = {}
+        self.closed = False
+        self._messages: Deque[str] = deque()
+        # комната -> пользователь -> последнее состояние
+        self._state: Dict[str, Dict[str, Dict]] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # (код, причина) закрытия после отправки очереди - см. finish()
+        self._close_with: Optional[tuple] = None
+
+    def send(self, text: str):
+        if self.closed or self._close_with is not None:
+            return
+        if len(self._messages) >= CLIENT_MAX_BACKLOG:
+            CHAT_SLOW_CONSUMERS.inc()
+            logger.warning("Slow consumer disconnected", extra={"user": self.user_key, "rooms": list(self.rooms)})
+            self.closed = True
+            self._messages.clear()
+            self._task.cancel()
+            asyncio.create_task(self._close(CLOSE_TRY_AGAIN_LATER))
+            return
+        self._messages.append(text)
+        self._wakeup.set()
+
+    def send_state(self, room: str, users: Dict[str, Dict]):
+        if self.closed:
+            return
+        # Своё состояние клиенту не нужно
+        users = {key: value for key, value in users.items() if key != self.user_key}
+        if not users:
+            return
+        pending = self._state.setdefault(room, {})
+        CHAT_EPHEMERAL_COALESCED.inc(len(pending.keys() & users.keys()))
+        pending.update(users)
+        self._wakeup.set()
+
+    def finish(self, code: int, reason: str = "", last_frame: Optional[str] = None):
+        """
+        Закрыть сокет, когда писатель отправит всё, что уже в очереди (и last_frame).
+        Писать в сокет мимо задачи-писателя нельзя - это была бы вторая отправка параллельно.
+        """
+        if self.closed or self._close_with is not None:
+            return
+        if last_frame is not None:
+            self._messages.append(last_frame)
+        self._close_with = (code, reason)
+        self._wakeup.set()
+
+    async def wait_finished(self):
+        if self._task is None:
+            return
+        try:
+            await asyncio.shield(self._task)
+        except asyncio.CancelledError:
+            pass
+
+    async def _close(self, code: int, reason: str = ""):
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    async def _run(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self._messages:
+                    await self.websocket.send_text(self._messages.popleft())
+                # Состояние - только когда сообщения отправлены
+                if self._state:
+                    state, self._state = self._state, {}
+                    for room, users in state.items():
+                        await self.websocket.send_text(json.dumps(
+                            {"type": "state", "room": room, "users": list(users.values())}, ensure_ascii=False
+                        ))
+                if self._close_with is not None and not self._messages:
+                    self.closed = True
+                    await self._close(*self._close_with)
+                    return
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Сокет умер - приём в websocket_endpoint тоже упадёт и снимет регистрацию
+            self.closed = True
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        self.closed = True
+        if self._task is not None:
+            self._task.cancel()
+
+
+class StreamListener:
+    """
+    Читатель комнаты через SSE: только очередь готовых кадров, без своей задачи.
+
+    Кадры кодируются один раз на комнату в ChatHub, пишет их задача самого
+    HTTP-запроса. Отставший читатель не копит очередь, а отключается: браузер
+    переподключится с Last-Event-ID и догрузит пропущенное из истории.
+    """
+
+    def __init__(self, room: str, user_key: str):
+        self.room = room
+        self.user_key = user_key
+        self.closed = False
+        self._frames: Deque[str] = deque()
+        self._wakeup = asyncio.Event()
+
+    def send(self, frame: str):
+        if self.closed:
+            return
+        if len(self._frames) >= CLIENT_MAX_BACKLOG:
+            CHAT_SLOW_CONSUMERS.inc()
+            logger.warning("Slow stream listener disconnected", extra={"user": self.user_key, "rooms": [self.room]})
+            self._frames.clear()
+            self.close()
+            return
+        self._frames.append(frame)
+        self._wakeup.set()
+
+    def close(self, retry_ms: Optional[int] = None):
+        """Завершает поток; retry_ms - через сколько браузеру переподключаться"""
+        if self.closed:
+            return
+        if retry_ms is not None:
+            self._frames.append(f"retry: {retry_ms}\n\n")
+        self.closed = True
+        self._wakeup.set()
+
+    async def frames(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            self._wakeup.clear()
+            while self._frames:
+                yield self._frames.popleft()
+            if self.closed:
+                return
+
+
+class ChatHub:
+    """
+    Подключения чата по комнатам и эфемерный канал состояния.
+
+    typing/stop_typing и появление/уход пользователей никуда не сохраняются:
+    они меняют состояние комнаты в памяти, а раз в EPHEMERAL_FLUSH_MS
+    каждая изменившаяся комната получает один кадр state с последним
+    состоянием каждого изменившегося пользователя.
+
+    Кроме сокетов у комнаты бывают читатели через SSE (StreamListener): они
+    не считаются присутствующими и получают те же кадры, закодированные
+    один раз на всю комнату.
+    """
+
+    def __init__(self, flush_interval: float = EPHEMERAL_FLUSH_MS / 1000):
+        self.flush_interval = flush_interval
+        # websocket -> подключение (по ключам идёт drain)
+        self.connections: Dict[WebSocket, ClientConnection] = {}
+        self._rooms: Dict[str, Dict[WebSocket, ClientConnection]] = {}
+        # все SSE-читатели (по ним идёт drain) и они же по комнатам
+        self.listeners: Set[StreamListener] = set()
+        self._listeners: Dict[str, Set[StreamListener]] = {}
+        # комната -> пользователь -> {"user", "online", "typing"}
+        self._state: Dict[str, Dict[str, Dict]] = {}
+        # комната -> пользователь -> число его сокетов в комнате
+        self._sockets: Dict[str, Dict[str, int]] = {}
+        # пользователь печатает до (monotonic)
+        self._typing_until: Dict[tuple, float] = {}
+        self._dirty: Dict[str, Dict[str, Dict]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def connect(self, websocket: WebSocket, user_key: str, user_name: str) -> ClientConnection:
+        connection = ClientConnection(websocket, user_key, user_name)
+        connection.start()
+        self.connections[websocket] = connection
+        return connection
+
+    def join(self, connection: ClientConnection, room: str) -> bool:
+        if room in connection.rooms or len(connection.rooms) >= MAX_SUBSCRIPTIONS:
+            return False
+        connection.rooms[room] = None
+        self._rooms.setdefault(room, {})[connection.websocket] = connection
+        CHAT_CONNECTED_SOCKETS.inc(room=room)
+
+        sockets = self._sockets.setdefault(room, {})
+        sockets[connection.user_key] = sockets.get(connection.user_key, 0) + 1
+        if sockets[connection.user_key] == 1:
+            self._update(room, connection.user_key, user=connection.user_name, online=True, typing=False)
+        # Новому клиенту - полный снимок комнаты
+        connection.send_state(room, dict(self._state.get(room, {})))
+        return True
+
+    def disconnect(self, websocket: WebSocket):
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
+            return
+        connection.stop()
+        for room in list(connection.rooms):
+            self.leave(connection, room)
+
+    def leave(self, connection: ClientConnection, room: str) -> bool:
+        if room not in connection.rooms:
+            return False
+        del connection.rooms[room]
+        self._rooms.get(room, {}).pop(connection.websocket, None)
+        CHAT_CONNECTED_SOCKETS.dec(room=room)
+
+        sockets = self._sockets.get(room, {})
+        sockets[connection.user_key] = sockets.get(connection.user_key, 1) - 1
+        if sockets[connection.user_key] <= 0:
+            sockets.pop(connection.user_key, None)
+            self._typing_until.pop((room, connection.user_key), None)
+            self._update(room, connection.user_key, online=False, typing=False)
+            self._state.get(room, {}).pop(connection.user_key, None)
+        if not self._rooms.get(room):
+            self._rooms.pop(room, None)
+            self._sockets.pop(room, None)
+            self._state.pop(room, None)
+            CHAT_CONNECTED_SOCKETS.remove(room=room)
+        return True
+
+    def listen(self, room: str, user_key: str) -> StreamListener:
+        listener = StreamListener(room, user_key)
+        self.listeners.add(listener)
+        self._listeners.setdefault(room, set()).add(listener)
+        CHAT_STREAM_LISTENERS.inc(room=room)
+        state = self._state.get(room)
+        if state:
+            listener.send(self._state_frame(room, state))
+        return listener
+
+    def unlisten(self, listener: StreamListener):
+        if listener not in self.listeners:
+            return
+        listener.close()
+        self.listeners.discard(listener)
+        listeners = self._listeners.get(listener.room, set())
+        listeners.discard(listener)
+        CHAT_STREAM_LISTENERS.dec(room=listener.room)
+        if not listeners:
+            self._listeners.pop(listener.room, None)
+            CHAT_STREAM_LISTENERS.remove(room=listener.room)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "sockets": len(self.connections),
+            "listeners": len(self.listeners),
+            "users": len({connection.user_key for connection in self.connections.values()}),
+            "rooms": len(self._rooms.keys() | self._listeners.keys()),
+        }
+
+    def broadcast(self, room: str, text: str, event_id: Optional[str] = None):
+        """event_id - курсор сообщения для Last-Event-ID, у служебных кадров его нет"""
+        for connection in list(self._rooms.get(room, {}).values()):
+            connection.send(text)
+        listeners = self._listeners.get(room)
+        if listeners:
+            frame = sse_frame(text, event_id)
+            for listener in list(listeners):
+                listener.send(frame)
+
+    @staticmethod
+    def _state_frame(room: str, users: Dict[str, Dict]) -> str:
+        return sse_frame(json.dumps({"type": "state", "room": room, "users": list(users.values())}, ensure_ascii=False))
+
+    def set_typing(self, connection: ClientConnection, room: str, typing: bool):
+        if room not in connection.rooms:
+            return
+        key = (room, connection.user_key)
+        if typing:
+            self._typing_until[key] = time.monotonic() + TYPING_TIMEOUT_SECONDS
+        elif self._typing_until.pop(key, None) is None:
+            return
+        current = self._state.get(room, {}).get(connection.user_key, {})
+        if current.get("typing") != typing:
+            self._update(room, connection.user_key, typing=typing)
+
+    def _update(self, room: str, user_key: str, **changes):
+        state = self._state.setdefault(room, {}).setdefault(user_key, {"user": "", "online": False, "typing": False})
+        state.update(changes)
+        self._dirty.setdefault(room, {})[user_key] = dict(state)
+
+    def flush(self):
+        now = time.monotonic()
+        for key, until in list(self._typing_until.items()):
+            if until <= now:
+                del self._typing_until[key]
+                self._update(key[0], key[1], typing=False)
+
+        dirty, self._dirty = self._dirty, {}
+        for room, users in dirty.items():
+            for connection in self._rooms.get(room, {}).values():
+                connection.send_state(room, users)
+            listeners = self._listeners.get(room)
+            if listeners:
+                frame = self._state_frame(room, users)
+                for listener in list(listeners):
+                    listener.send(frame)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка рассылки состояния: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+hub = ChatHub()
@@ -1,24 +1,65 @@
 import os
+import time
+from typing import Optional
+from urllib.parse import unquote
 
 import jwt
 from fastapi import Request, HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
+
+from metrics import AUTH_MIDDLEWARE_SECONDS, JWT_DECODE_SECONDS
 
 JWT_SECRET = os.getenv("JWT_SECRET", "secret")
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_COOKIE_NAME = os.getenv("ACCESS_COOKIE_NAME", "access_token")
 REFRESH_COOKIE_NAME = os.getenv("REFRESH_COOKIE_NAME", "refresh_token")
+# Токен уже проверил gateway (auth_request в auth_reg), личность приходит в X-User-*
+TRUST_GATEWAY_HEADERS = os.getenv("TRUST_GATEWAY_HEADERS", "false").lower() in ("1", "true", "yes")
+
+
+def user_from_gateway(headers) -> Optional[dict]:
+    """
+    Пользователь из заголовков X-User-*, которые ставит gateway после auth_request.
+    Доверять им можно, только если сервис доступен лишь через gateway (TRUST_GATEWAY_HEADERS).
+    """
+    if not TRUST_GATEWAY_HEADERS or not headers.get("x-user-email"):
+        return None
+    return {
+        "type": "access",
+        "id": headers.get("x-user-id") or None,
+        "email": unquote(headers["x-user-email"]),
+        "last_name": unquote(headers.get("x-user-last-name", "")),
+        "first_name": unquote(headers.get("x-user-first-name", "")),
+        "middle_name": unquote(headers.get("x-user-middle-name", "")),
+        "is_admin": headers.get("x-user-admin") == "1",
+    }
+
+
+class AuthMiddleware:
+    """
+    Кладёт пользователя из токена в request.state.user.
+
+    Чистый ASGI, а не BaseHTTPMiddleware: тот прогоняет каждый потоковый
+    ответ (SSE, выгрузки) через лишнюю задачу и канал в памяти.
+    """
+
+    def __init__(self, app):
+        self.app = app
 
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-class AuthMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        request.state.user = None
+        request = Request(scope)
+        started = time.perf_counter()
+        request.state.user = user_from_gateway(request.headers)
         token = request.cookies.get(ACCESS_COOKIE_NAME)
 
-        if token:
+        if token and request.state.user is None:
             try:
                 # Пытаемся декодировать access token
-                payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+                with JWT_DECODE_SECONDS.time():
+                    payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
                 if payload.get("type") == "access":
                     request.state.user = payload
 
@@ -47,5 +88,5 @@ class AuthMiddleware(BaseHTTPMiddleware):
                 # Любая другая ошибка декодирования
                 request.state.user = None
 
-        response = await call_next(request)
-        return response
+        AUTH_MIDDLEWARE_SECONDS.observe(time.perf_counter() - started)
+        await self.app(scope, receive, send)
@@ -0,0 +1,148 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+from metrics import Counter
+
+# Размер очереди логов: при переполнении записи отбрасываются, event loop не ждёт диск
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# Переопределение правил сервиса из окружения.
+# Доля записей уровня ниже WARNING, которые пишутся: "chat_main.messages=0.1,other=0.5"
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")
+# Не больше N записей в секунду на логгер: "chat_main.messages=100"
+LOG_RATE_LIMITS = os.getenv("LOG_RATE_LIMITS", "")
+
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped_total", "Отброшенные записи лога", ["reason"]
+)
+
+# Стандартные атрибуты LogRecord: всё остальное (extra=...) попадает в JSON как поля
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def parse_rules(value: str) -> Dict[str, float]:
+    rules = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, rate = item.split("=", 1)
+            rules[name.strip()] = float(rate)
+    return rules
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Сэмплирование и ограничение частоты по имени логгера.
+
+    Сэмплируются только записи ниже WARNING; лимит частоты (окно в 1 секунду)
+    действует на все уровни, чтобы поток однотипных предупреждений не забил очередь.
+    """
+
+    def __init__(self, sampling: Dict[str, float], rate_limits: Dict[str, float]):
+        super().__init__()
+        self.sampling = sampling
+        self.rate_limits = rate_limits
+        # logger -> [начало окна, записей в окне]
+        self._windows: Dict[str, list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.sampling.get(record.name)
+        if rate is not None and record.levelno < logging.WARNING and random.random() >= rate:
+            LOG_RECORDS_DROPPED.inc(reason="sampled")
+            return False
+
+        limit = self.rate_limits.get(record.name)
+        if limit is not None:
+            now = time.monotonic()
+            window = self._windows.setdefault(record.name, [now, 0])
+            if now - window[0] >= 1:
+                window[0], window[1] = now, 0
+            if window[1] >= limit:
+                LOG_RECORDS_DROPPED.inc(reason="rate_limited")
+                return False
+            window[1] += 1
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler, который при полной очереди отбрасывает запись и считает её"""
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc(reason="queue_full")
+
+
+class DrainingQueueListener(QueueListener):
+    """При остановке ждёт место в полной очереди, а не падает на put_nowait"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel, timeout=5)
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(
+        filename: str,
+        level: int = logging.INFO,
+        sampling: Optional[Dict[str, float]] = None,
+        rate_limits: Optional[Dict[str, float]] = None,
+) -> QueueListener:
+    """
+    Логирование через ограниченную очередь: в event loop только put_nowait,
+    запись в файл делает фоновый поток QueueListener.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    file_handler = logging.FileHandler(filename, encoding="UTF-8")
+    file_handler.setFormatter(JsonFormatter())
+
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    queue_handler.addFilter(SamplingFilter(
+        {**(sampling or {}), **parse_rules(LOG_SAMPLING)},
+        {**(rate_limits or {}), **parse_rules(LOG_RATE_LIMITS)},
+    ))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+
+    _listener = DrainingQueueListener(queue_handler.queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Дописывает остаток очереди и останавливает фоновый поток"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,26 +1,61 @@
+from startup import startup_report, LazyTemplates, StartupGateMiddleware, install_startup
+
 import asyncio
 import datetime
 import json
 import logging
 import os
+import re
 from http.cookies import SimpleCookie
 from pathlib import Path
+from typing import Optional
+from urllib.parse import quote
+
+with startup_report.measure("fastapi"):
+    from fastapi import FastAPI, Path as PathParam, Query, Request, WebSocket
+    from fastapi.exceptions import HTTPException
+    from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
+    from fastapi.staticfiles import StaticFiles
+    from fastapi.middleware import Middleware
+    from pydantic import BaseModel, Field
+
+with startup_report.measure("httpx, jwt"):
+    import httpx
+    import jwt
+
+with startup_report.measure("sqlmodel"):
+    from storage import (
+        Attachment, Message, close_storage, get_attachment, get_engine, get_write_engine, get_read_engine,
+        init_storage, load_history, save_attachment, save_message,
+    )
 
-import httpx
-import jwt
-from fastapi import FastAPI, Request, WebSocket
-from fastapi.exceptions import HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.middleware import Middleware
-from fastapi.templating import Jinja2Templates
-from sqlmodel import SQLModel, Field, create_engine, Session, select
-
-import validator
-
-from jwtapi import AuthMiddleware
+with startup_report.measure("validator"):
+    import validator
+
+with startup_report.measure("service modules"):
+    from jwtapi import AuthMiddleware, user_from_gateway
+    from drain import drainer, reconnect_delay_ms, send_reconnect_hint
+    from hub import CONTROL_TYPES, EPHEMERAL_TYPES, MAX_SUBSCRIPTIONS, hub, sse_frame
+    from search import SEARCH_MAX_LIMIT, SEARCH_MAX_OFFSET, init_fts, search_messages
+    from retention import MONTH_RE, MessageArchiver, archive_months, read_archive
+    from export import EXPORT_FORMATS, init_export, iter_room_messages, stream_export
+    from logconfig import setup_logging, stop_logging
+    from profiling import ProfilingMiddleware, install_profiling, require_admin
+    from attachments import (
+        ATTACHMENT_MAX_BYTES, ATTACHMENTS_ACCEL_PREFIX, AttachmentTooLarge, attachment_headers, blob_path,
+        blob_relative_path, clean_filename, disposition_type, etag_matches, new_attachment_id, store_upload,
+    )
+    from moderation import RESTORE_BROADCAST_LIMIT, RETRACT_CHUNK_SIZE, ModerationIn, init_moderation, set_visibility
+    from metrics import (
+        Counter, Histogram, MetricsMiddleware, JWT_DECODE_SECONDS, metrics_endpoint,
+    )
 
-app = FastAPI(middleware=[Middleware(AuthMiddleware)])
+app = FastAPI(middleware=[
+    Middleware(MetricsMiddleware), Middleware(StartupGateMiddleware), Middleware(AuthMiddleware), Middleware(ProfilingMiddleware),
+])
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+install_profiling(app)
+install_startup(app)
 
 # Получаем абсолютный путь к директории проекта
 BASE_DIR = Path(__file__).parent
@@ -28,42 +63,92 @@ BASE_DIR = Path(__file__).parent
 # Подключаем статические файлы с абсолютными путями
 app.mount("/static", StaticFiles(directory=BASE_DIR / "static"), name="static")
 
-# Подключаем шаблоны
-templates = Jinja2Templates(directory=BASE_DIR / "templates")
+# Подключаем шаблоны (jinja2 импортируется при старте в фоне)
+templates = LazyTemplates(BASE_DIR / "templates")
 
-DATABASE_URL = "sqlite:///messages.db"
-engine = create_engine(DATABASE_URL, echo=False, connect_args={"check_same_thread": False})
-connected_clients = set()
-logging.basicConfig(filename="chat_main.log", level=logging.INFO, encoding="UTF-8")
+setup_logging("chat_main.log", rate_limits={"chat_main.messages": 100})
+# Строки на каждое сообщение: отдельный логгер, чтобы их можно было сэмплировать
+message_logger = logging.getLogger("chat_main.messages")
 client = None
 
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 JWT_SECRET = os.getenv("JWT_SECRET", "secret")
 ACCESS_COOKIE_NAME = os.getenv("ACCESS_COOKIE_NAME", "access-name")
 
+# Комната, куда попадает клиент без ?room=
+DEFAULT_ROOM = "qwerty"
+MAX_ROOM_LENGTH = 64
+# Имя комнаты попадает в метки метрик и пути архивов - только безопасные символы
+ROOM_PATTERN = rf"^[A-Za-z0-9_-]{{1,{MAX_ROOM_LENGTH}}}$"
+ROOM_RE = re.compile(ROOM_PATTERN)
+
+
+def is_valid_room(room) -> bool:
+    return isinstance(room, str) and ROOM_RE.match(room) is not None
+
+
+# Заголовок, который ставит JS чата: с ним запрос не "простой", и чужой сайт
+# не отправит его без CORS-preflight (куки авторизации - SameSite=None)
+CLIENT_HEADER = "x-requested-with"
+
+
+def require_same_site(request: Request):
+    """Защита POST-ов с телом от CSRF: свой заголовок и, если браузер его прислал, Sec-Fetch-Site"""
+    if request.headers.get("sec-fetch-site", "same-origin") not in ("same-origin", "none"):
+        raise HTTPException(status_code=403, detail="Cross-site request")
+    if not request.headers.get(CLIENT_HEADER):
+        raise HTTPException(status_code=403, detail=f"Missing {CLIENT_HEADER} header")
 
-# ---------- Модель ----------
-class Message(SQLModel, table=True):
-    id: int | None = Field(default=None, primary_key=True)
-    id_in_html: str = Field(default_factory=validator.id_in_html)
-    sender: str
-    text: str
-    room: str = "qwerty"
-    visibility: bool = True
-    timestamp: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+
+class MessageIn(BaseModel):
+    room: str = Field(DEFAULT_ROOM, pattern=ROOM_PATTERN)
+    text: str = Field(..., min_length=1)
+
+
+# ---------- Метрики ----------
+CHAT_VALIDATION_SECONDS = Histogram("chat_validation_seconds", "Время validator.process_message")
+CHAT_BROADCAST_SECONDS = Histogram("chat_broadcast_seconds", "Время рассылки сообщения клиентам")
+CHAT_PERSIST_SECONDS = Histogram("chat_persist_seconds", "Время сохранения сообщения в БД")
+CHAT_MESSAGES = Counter("chat_messages_total", "Принятые сообщения чата")
+
+process_message = CHAT_VALIDATION_SECONDS.time()(validator.process_message)
+
+
+# Старые сообщения уходят из messages.db в сжатые архивы по комнатам и месяцам
+message_archiver = MessageArchiver(get_engine)
 
 
 # ---------- Инициализация ----------
+def init_database():
+    init_storage()
+    init_fts(get_engine())
+    init_export(get_engine())
+    init_moderation(get_engine())
+    message_archiver.init()
+
+
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
     global client
     client = httpx.AsyncClient()
-    SQLModel.metadata.create_all(engine)
+    # Тяжёлая инициализация - в потоках, /ready ответит 200 после её завершения
+    startup_report.build_in_background("database", init_database)
+    startup_report.build_in_background("banword automaton", validator.load_automaton)
+    startup_report.build_in_background("templates", templates.load)
+    startup_report.finish_startup()
+    message_archiver.start()
+    hub.start()
+    # SIGTERM сначала плавно разгружает сокеты, потом штатная остановка uvicorn
+    drainer.install_signal_handler(hub.connections, hub.listeners, on_start=startup_report.begin_shutdown)
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await message_archiver.stop()
+    await hub.stop()
     await client.aclose()
+    await close_storage()
+    stop_logging()
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -77,6 +162,255 @@ async def get(request: Request):
     )
 
 
+@app.get("/stats", include_in_schema=False)
+async def stats():
+    """Счётчики для живой панели администратора (auth_reg опрашивает раз в тик, в gateway закрыт)"""
+    return {**hub.stats(), "messages_total": CHAT_MESSAGES.value()}
+
+
+@app.get("/search")
+async def search(
+        request: Request,
+        room: str = Query(..., pattern=ROOM_PATTERN),
+        q: str = Query(..., min_length=1, max_length=200),
+        limit: int = Query(20, ge=1, le=SEARCH_MAX_LIMIT),
+        offset: int = Query(0, ge=0, le=SEARCH_MAX_OFFSET),
+):
+    """Полнотекстовый поиск по истории комнаты (FTS5), страницы по limit/offset"""
+    if not request.state.user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+    # На одну запись больше, чтобы понять, есть ли следующая страница
+    results = await search_messages(get_read_engine(), room, q, limit + 1, offset)
+    has_more = len(results) > limit
+    return {
+        "room": room,
+        "query": q,
+        "results": results[:limit],
+        "next_offset": offset + limit if has_more else None,
+    }
+
+
+@app.get("/archive/{room}")
+async def list_archive(request: Request, room: str = PathParam(..., pattern=ROOM_PATTERN)):
+    """Месяцы, за которые у комнаты есть архив"""
+    if not request.state.user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return {"room": room, "months": archive_months(room)}
+
+
+@app.get("/archive/{room}/{month}")
+async def get_archive(request: Request, month: str, room: str = PathParam(..., pattern=ROOM_PATTERN)):
+    """Архив комнаты за месяц (ГГГГ-ММ), распаковывается потоком в NDJSON"""
+    if not request.state.user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if not MONTH_RE.match(month) or month not in archive_months(room):
+        raise HTTPException(status_code=404, detail="Archive not found")
+
+    def lines():
+        for record in read_archive(room, month):
+            yield json.dumps(record, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/export/{room}")
+async def export_room(
+        request: Request,
+        room: str = PathParam(..., pattern=ROOM_PATTERN),
+        format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+        compress: bool = False,
+        include_archive: bool = True,
+        include_hidden: bool = False,
+):
+    """
+    Выгрузка всей истории комнаты потоком (NDJSON или CSV, по желанию gzip).
+    Скрытые сообщения - только для админов.
+    """
+    user = request.state.user
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if include_hidden and not user.get("is_admin", False):
+        raise HTTPException(status_code=403, detail="Admin only")
+
+    records = iter_room_messages(get_engine(), room, include_hidden, include_archive)
+    filename = f"chat-{quote(room, safe='')}.{format}" + (".gz" if compress else "")
+    # Синхронный генератор Starlette крутит в threadpool, event loop чата не блокируется
+    return StreamingResponse(
+        stream_export(records, format, compress),
+        media_type="application/gzip" if compress else EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@app.post("/moderation/visibility")
+async def moderate_visibility(request: Request, data: ModerationIn):
+    """
+    Скрыть/вернуть сообщения по id, htmlid, отправителю и/или диапазону времени.
+    Клиентам комнаты уходит retract со списком скрытых htmlid.
+    """
+    require_admin(request)
+    changed = await set_visibility(get_write_engine(), data)
+
+    for room, messages in changed.items():
+        if data.action == "hide":
+            htmlids = [message["htmlid"] for message in messages]
+            for start in range(0, len(htmlids), RETRACT_CHUNK_SIZE):
+                event = {"type": "retract", "room": room, "htmlids": htmlids[start:start + RETRACT_CHUNK_SIZE]}
+                hub.broadcast(room, json.dumps(event))
+        else:
+            for message in messages[-RESTORE_BROADCAST_LIMIT:]:
+                hub.broadcast(room, json.dumps(message))
+
+    return {
+        "action": data.action,
+        "changed": sum(len(messages) for messages in changed.values()),
+        "rooms": {room: len(messages) for room, messages in changed.items()},
+    }
+
+
+@app.post("/attachments")
+async def upload_attachment(
+        request: Request,
+        room: str = Query(..., pattern=ROOM_PATTERN),
+        filename: str = Query(..., min_length=1),
+):
+    """
+    Загрузка вложения: тело запроса - сам файл (Content-Type - его тип).
+    Файл пишется на диск потоком, в комнату уходит короткое сообщение со ссылкой.
+    """
+    user = request.state.user
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    require_same_site(request)
+    if drainer.draining:
+        raise HTTPException(status_code=503, detail="Service is restarting")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > ATTACHMENT_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Attachment is too large")
+
+    try:
+        sha256, size = await store_upload(request.stream())
+    except AttachmentTooLarge:
+        raise HTTPException(status_code=413, detail="Attachment is too large")
+
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    attachment = Attachment(
+        id=new_attachment_id(),
+        sha256=sha256,
+        filename=clean_filename(filename),
+        content_type=content_type or "application/octet-stream",
+        size=size,
+        room=room,
+        uploader=user.get("email", ""),
+    )
+    await save_attachment(attachment)
+
+    reference = {
+        "id": attachment.id,
+        "name": attachment.filename,
+        "size": attachment.size,
+        "type": attachment.content_type,
+    }
+    msg = Message(
+        sender=display_name(user), text=attachment.filename, room=room,
+        attachment=json.dumps(reference, ensure_ascii=False),
+    )
+    with drainer.write():
+        await handle_message(msg)
+    return {"htmlid": msg.id_in_html, "attachment": reference}
+
+
+@app.get("/attachments/{attachment_id}")
+async def download_attachment(request: Request, attachment_id: str):
+    """
+    Скачивание вложения с поддержкой Range. ETag - sha256 содержимого,
+    файл по ссылке не меняется, поэтому кэшируется браузером надолго.
+    """
+    if not request.state.user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    attachment = await get_attachment(attachment_id)
+    if attachment is None:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+
+    headers = attachment_headers(attachment.sha256)
+    if etag_matches(request.headers.get("if-none-match", ""), attachment.sha256):
+        return Response(status_code=304, headers=headers)
+
+    disposition = disposition_type(attachment.content_type)
+    if ATTACHMENTS_ACCEL_PREFIX:
+        # Байты отдаёт nginx через sendfile, Range он обрабатывает сам
+        headers["X-Accel-Redirect"] = ATTACHMENTS_ACCEL_PREFIX + blob_relative_path(attachment.sha256)
+        headers["Content-Disposition"] = f"{disposition}; filename*=utf-8''{quote(attachment.filename)}"
+        return Response(media_type=attachment.content_type, headers=headers)
+
+    return FileResponse(
+        blob_path(attachment.sha256),
+        media_type=attachment.content_type,
+        filename=attachment.filename,
+        content_disposition_type=disposition,
+        headers=headers,
+    )
+
+
+# ---------- SSE ----------
+@app.get("/stream")
+async def stream_room(
+        request: Request,
+        room: str = Query(DEFAULT_ROOM, pattern=ROOM_PATTERN),
+        since: Optional[str] = None,
+):
+    """
+    Чтение комнаты без WebSocket: история после курсора, subscribed, дальше те же
+    кадры, что уходят сокетам. id кадра сообщения - его время, браузер сам
+    присылает последний в Last-Event-ID при переподключении. Отправка - POST /messages.
+    """
+    user = request.state.user
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if drainer.draining:
+        # Инстанс выключается - браузер переподключится через случайную задержку
+        frames = iter([f"retry: {reconnect_delay_ms()}\n\n"])
+    else:
+        since = parse_since(request.headers.get("last-event-id") or since)
+        frames = room_events(room, user.get("email") or display_name(user), since)
+    return StreamingResponse(
+        frames,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def room_events(room: str, user_key: str, since: Optional[datetime.datetime]):
+    # Читатель регистрируется до загрузки истории, чтобы не потерять сообщения,
+    # пришедшие за это время (повтор из истории клиент узнаёт по htmlid)
+    listener = hub.listen(room, user_key)
+    try:
+        for msg in await load_history(room, since):
+            yield sse_frame(message_frame(msg), msg.timestamp.isoformat())
+        yield sse_frame(json.dumps({"type": "subscribed", "room": room}))
+        async for frame in listener.frames():
+            yield frame
+    finally:
+        hub.unlisten(listener)
+
+
+@app.post("/messages")
+async def post_message(request: Request, data: MessageIn):
+    """Отправка сообщения без WebSocket (для читателей через /stream), дальше - как из сокета"""
+    user = request.state.user
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    require_same_site(request)
+    if drainer.draining:
+        raise HTTPException(status_code=503, detail="Service is restarting")
+
+    msg = Message(sender=display_name(user), text=data.text, room=data.room)
+    with drainer.write():
+        await handle_message(msg)
+    return {"htmlid": msg.id_in_html, "time": msg.timestamp.isoformat()}
+
+
 # Парсер куки для получения JWT юзера
 def parse_cookies_from_header(cookie_header: str) -> dict:
     if not cookie_header:
@@ -91,6 +425,14 @@ def parse_cookies_from_header(cookie_header: str) -> dict:
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
 
+    if drainer.draining or not startup_report.initialized:
+        # Инстанс выключается или ещё не создал таблицы - сразу отправляем клиента переподключаться
+        await send_reconnect_hint(websocket)
+        return
+
+    # За gateway токен уже проверен auth_request, иначе - сами по куке
+    user = user_from_gateway(websocket.headers)
+
     cookie_header = None
     for k, v in websocket.headers.raw:
         # raw — list of tuples bytes, decode
@@ -101,10 +443,10 @@ async def websocket_endpoint(websocket: WebSocket):
 
     cookies = parse_cookies_from_header(cookie_header)
     token = cookies.get(ACCESS_COOKIE_NAME)
-    user = None
-    if token:
+    if token and user is None:
         try:
-            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+            with JWT_DECODE_SECONDS.time():
+                payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
             if payload.get("type") == "access":
                 user = payload
         except Exception:
@@ -115,59 +457,165 @@ async def websocket_endpoint(websocket: WebSocket):
         await websocket.close(code=1008)
         return
 
-    connected_clients.add(websocket)
-
-    user_name = f"{user['last_name']} {user['first_name'][0]}.{user['middle_name'][0]}."
-    room = "qwerty"  # заглушка, потом можно будет менять по URL или параметру
-
-    # Загружаем последние 50 сообщений из нужной комнаты
-    with Session(engine) as session:
-        msgs = session.exec(
-            select(Message)
-            .where(Message.room == room)
-            .where(Message.visibility)
-            .order_by(Message.id.desc())
-            .limit(50)
-        ).all()
-
-        for msg in reversed(msgs):
-            await websocket.send_text(json.dumps({
-                "htmlid": msg.id_in_html,
-                "sender": msg.sender,
-                "text": msg.text,
-                "room": msg.room,
-                "visibility": msg.visibility,
-                "time": msg.timestamp.isoformat()
-            }))
-
-    # Обработка получения сообщений от клиента
+    user_name = display_name(user)
+    # Первая комната - из URL (по умолчанию общий чат), остальные - через subscribe
+    room = websocket.query_params.get("room") or DEFAULT_ROOM
+
+    # Регистрация и первая подписка (загрузка истории) - внутри try: если они упадут,
+    # подключение, его задача-писатель и gauge не останутся в хабе навсегда
     try:
+        connection = hub.connect(websocket, user.get("email") or user_name, user_name)
+        await subscribe(connection, room, websocket.query_params.get("since"))
+
+        # Обработка получения сообщений от клиента
         while True:
             text = await websocket.receive_text()
-            msg = Message(sender=user_name, text=text, room=room)
+            event = parse_event(text)
+            if event is None:
+                # Простой текст - сообщение в комнату по умолчанию
+                if not connection.rooms:
+                    connection.send(error_frame("Нет подписки на комнату"))
+                    continue
+                room = next(iter(connection.rooms))
+            elif event["type"] in EPHEMERAL_TYPES:
+                # typing/stop_typing: только состояние в памяти, без БД и валидатора
+                hub.set_typing(connection, event_room(connection, event), event["type"] == "typing")
+                continue
+            elif event["type"] == "subscribe":
+                await subscribe(connection, event.get("room"), event.get("since"))
+                continue
+            elif event["type"] == "unsubscribe":
+                if hub.leave(connection, event.get("room")):
+                    connection.send(json.dumps({"type": "unsubscribed", "room": event["room"]}))
+                continue
+            else:
+                room, text = event.get("room"), event.get("text")
+                if room not in connection.rooms or not isinstance(text, str) or not text:
+                    connection.send(error_frame("Сообщение в комнату без подписки"))
+                    continue
+
+            hub.set_typing(connection, room, False)
+            # При drain сообщение, которое уже приняли, успеет сохраниться
+            with drainer.write():
+                await handle_message(Message(sender=user_name, text=text, room=room))
+
+    except Exception:
+        # Клиент закрыл сокет или обработка упала (например, загрузка истории) -
+        # закрываем сокет, если он ещё открыт, чтобы клиент не ждал молча
+        try:
+            await websocket.close(code=1011)
+        except Exception:
+            pass
+    finally:
+        hub.disconnect(websocket)
 
-            process_message_task = asyncio.create_task(validator.process_message(msg.text, msg.sender))
 
-            logging.info(f"New message[{msg.id_in_html}]: {msg.text}")
+def display_name(user: dict) -> str:
+    """Фамилия и инициалы; пустые части имени (бывают в токене и у личности от gateway) пропускаются"""
+    initials = "".join(f"{part[0]}." for part in (user.get("first_name"), user.get("middle_name")) if part)
+    name = " ".join(part for part in (user.get("last_name"), initials) if part)
+    return name or user.get("email") or "Аноним"
 
-            # Сообщения отправляются текущим connected_clients
-            await send_msg_to_clients(msg)
 
-            # Ожидаем ответ валидатора и при необходимости - отправляем новое сообщение
-            process_result = await process_message_task
-            if not process_result.is_valid:
-                logging.warning(f"Incorrect message from {msg.sender}: {process_result.reason} | text='{msg.text}'")
-                msg.text = process_result.new_message
-                await send_msg_to_clients(msg)
+def message_frame(msg: Message) -> str:
+    data = {
+        "htmlid": msg.id_in_html,
+        "sender": msg.sender,
+        "text": msg.text,
+        "room": msg.room,
+        "visibility": msg.visibility,
+        "time": msg.timestamp.isoformat(),
+    }
+    if msg.attachment:
+        # Клиенту уходит только ссылка, файл он скачивает по /attachments/{id}
+        data["attachment"] = json.loads(msg.attachment)
+    return json.dumps(data)
+
+
+def error_frame(detail: str) -> str:
+    return json.dumps({"type": "error", "detail": detail}, ensure_ascii=False)
 
-            # Сохраняем сообщение
-            with Session(engine) as session:
-                session.add(msg)
-                session.commit()
-                session.refresh(msg)
 
-    except Exception as e:
-        connected_clients.remove(websocket)
+def event_room(connection, event: dict):
+    """Комната события: явно указанная или комната по умолчанию"""
+    return event.get("room") or next(iter(connection.rooms), None)
+
+
+def parse_since(value) -> Optional[datetime.datetime]:
+    """Курсор клиента - время последнего полученного сообщения (поле time кадра)"""
+    if not isinstance(value, str):
+        return None
+    try:
+        since = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    # В БД время хранится наивным UTC
+    if since.tzinfo is not None:
+        since = since.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return since
+
+
+async def subscribe(connection, room, since=None):
+    """
+    Подписка сокета на комнату: история после курсора (или последние сообщения),
+    затем subscribed. История идёт через очередь подключения раньше новых сообщений.
+    """
+    if not is_valid_room(room):
+        connection.send(error_frame("Некорректная комната"))
+        return
+    if room in connection.rooms:
+        connection.send(json.dumps({"type": "subscribed", "room": room}))
+        return
+    if len(connection.rooms) >= MAX_SUBSCRIPTIONS:
+        connection.send(error_frame(f"Не больше {MAX_SUBSCRIPTIONS} комнат на подключение"))
+        return
+
+    # Читающий пул, loop не блокируется
+    for msg in await load_history(room, parse_since(since)):
+        connection.send(message_frame(msg))
+    hub.join(connection, room)
+    connection.send(json.dumps({"type": "subscribed", "room": room}))
+
+
+def parse_event(text: str):
+    """Управляющий или эфемерный кадр - JSON-объект с известным type, всё остальное - текст сообщения"""
+    if not text.startswith("{"):
+        return None
+    try:
+        event = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(event, dict) or event.get("type") not in EPHEMERAL_TYPES | CONTROL_TYPES:
+        return None
+    if not isinstance(event.get("room"), str):
+        event["room"] = None
+    return event
+
+
+async def handle_message(msg: Message):
+    CHAT_MESSAGES.inc()
+    process_message_task = asyncio.create_task(process_message(msg.text, msg.sender))
+
+    message_logger.info(
+        "New message", extra={"htmlid": msg.id_in_html, "room": msg.room, "text": msg.text}
+    )
+
+    # Сообщения отправляются текущим connected_clients
+    await send_msg_to_clients(msg)
+
+    # Ожидаем ответ валидатора и при необходимости - отправляем новое сообщение
+    process_result = await process_message_task
+    if not process_result.is_valid:
+        message_logger.warning(
+            "Incorrect message",
+            extra={"htmlid": msg.id_in_html, "sender": msg.sender, "reason": process_result.reason, "text": msg.text},
+        )
+        msg.text = process_result.new_message
+        await send_msg_to_clients(msg)
+
+    # Сохраняем сообщение через единственное пишущее соединение
+    with CHAT_PERSIST_SECONDS.time():
+        await save_message(msg)
 
 
 @app.exception_handler(HTTPException)
@@ -191,23 +639,7 @@ async def websocket_http_exception_handler(request: Request, exc: HTTPException)
     )
 
 
+@CHAT_BROADCAST_SECONDS.time()
 async def send_msg_to_clients(msg: Message):
-    data = {
-        "htmlid": msg.id_in_html,
-        "sender": msg.sender,
-        "text": msg.text,
-        "room": msg.room,
-        "visibility": msg.visibility,
-        "time": msg.timestamp.isoformat(),
-    }
-
-    # Рассылаем только тем, кто в этой комнате
-    dead = []
-    for client in connected_clients:
-        try:
-            # Тут можно будет хранить мапу {websocket: room}, но пока фильтруем по заглушке
-            await client.send_text(json.dumps(data))
-        except:
-            dead.append(client)
-    for d in dead:
-        connected_clients.remove(d)
+    # Только ставим в очереди клиентов комнаты, отправляют их задачи-писатели
+    hub.broadcast(msg.room, message_frame(msg), msg.timestamp.isoformat())
@@ -0,0 +1,98 @@
+from datetime import datetime, timezone
+from typing import Dict, List, Literal, Optional
+
+from pydantic import BaseModel, Field, model_validator
+
+from metrics import Counter, Histogram
+from retention import MESSAGE_COLUMNS, message_record
+
+MAX_MODERATION_IDS = 1000
+# Сколько id отправлять в одном retract-событии
+RETRACT_CHUNK_SIZE = 500
+# Возвращённые сообщения рассылаются клиентам, только если они среди последних N
+# (столько же история отдаёт при подключении), остальные видны после перезагрузки
+RESTORE_BROADCAST_LIMIT = 50
+
+CHAT_MODERATED_MESSAGES = Counter("chat_moderated_messages_total", "Сообщения, скрытые/возвращённые модерацией", ["action"])
+CHAT_MODERATION_SECONDS = Histogram("chat_moderation_seconds", "Время пакетного UPDATE видимости")
+
+_SQLITE_TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+class ModerationIn(BaseModel):
+    """
+    Какие сообщения скрыть/вернуть. Условия объединяются через AND,
+    хотя бы одно из ids/htmlids/sender/since/until обязательно.
+    """
+    action: Literal["hide", "unhide"]
+    ids: List[int] = Field(default_factory=list, max_length=MAX_MODERATION_IDS)
+    htmlids: List[str] = Field(default_factory=list, max_length=MAX_MODERATION_IDS)
+    sender: Optional[str] = None
+    room: Optional[str] = None
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+
+    @model_validator(mode="after")
+    def check_selector(self):
+        if not (self.ids or self.htmlids or self.sender or self.since or self.until):
+            raise ValueError("Нужно указать ids, htmlids, sender или диапазон времени")
+        return self
+
+
+def init_moderation(engine):
+    """Частичный индекс только по видимым сообщениям: под загрузку истории и выгрузку"""
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_message_visible_room_id ON message (room, id) WHERE visibility = 1"
+        )
+
+
+def _sqlite_time(value: datetime) -> str:
+    # В БД время хранится наивным UTC
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime(_SQLITE_TIME_FORMAT)
+
+
+@CHAT_MODERATION_SECONDS.time()
+async def set_visibility(engine, data: ModerationIn) -> Dict[str, List[Dict]]:
+    """
+    Один UPDATE ... RETURNING по всем условиям.
+    Трогает только строки, у которых видимость действительно меняется
+    (триггеры FTS переиндексируют ровно их). Возвращает комната -> изменённые сообщения по возрастанию id.
+    """
+    visible = data.action == "unhide"
+    conditions = ["visibility != ?"]
+    params: list = [int(visible)]
+    if data.ids:
+        conditions.append(f"id IN ({','.join('?' * len(data.ids))})")
+        params.extend(data.ids)
+    if data.htmlids:
+        conditions.append(f"id_in_html IN ({','.join('?' * len(data.htmlids))})")
+        params.extend(data.htmlids)
+    if data.sender:
+        conditions.append("sender = ?")
+        params.append(data.sender)
+    if data.room:
+        conditions.append("room = ?")
+        params.append(data.room)
+    if data.since:
+        conditions.append("timestamp >= ?")
+        params.append(_sqlite_time(data.since))
+    if data.until:
+        conditions.append("timestamp < ?")
+        params.append(_sqlite_time(data.until))
+
+    async with engine.begin() as connection:
+        result = await connection.exec_driver_sql(
+            f"UPDATE message SET visibility = ? WHERE {' AND '.join(conditions)} RETURNING {MESSAGE_COLUMNS}",
+            (int(visible), *params),
+        )
+        rows = result.all()
+
+    changed: Dict[str, List[Dict]] = {}
+    # RETURNING не гарантирует порядок строк, а клиентам сообщения нужны по порядку
+    for row in sorted(rows, key=lambda row: row.id):
+        changed.setdefault(row.room, []).append(message_record(row))
+    CHAT_MODERATED_MESSAGES.inc(len(rows), action=data.action)
+    return changed
@@ -0,0 +1,241 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import quote
+
+from logconfig import parse_rules
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Сколько дней сообщения лежат в messages.db, дальше - в архив
+RETENTION_HOT_DAYS = float(os.getenv("RETENTION_HOT_DAYS", 30))
+# Переопределение по комнатам: "room1=7,room2=365"
+RETENTION_ROOM_POLICIES = os.getenv("RETENTION_ROOM_POLICIES", "")
+# Не больше N последних сообщений комнаты в горячей БД (0 - без ограничения)
+RETENTION_MAX_ROOM_MESSAGES = int(os.getenv("RETENTION_MAX_ROOM_MESSAGES", 100000))
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", 3600))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", 5000))
+# Сколько свободных страниц возвращать ОС за один проход
+RETENTION_VACUUM_PAGES = int(os.getenv("RETENTION_VACUUM_PAGES", 2000))
+ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", "archive"))
+
+MONTH_RE = re.compile(r"^\d{4}-\d{2}$")
+# Формат, в котором SQLAlchemy хранит DateTime в SQLite: строки сравниваются как время
+_SQLITE_TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+CHAT_ARCHIVED_MESSAGES = Counter("chat_archived_messages_total", "Сообщения, перенесённые в архив")
+CHAT_RETENTION_SECONDS = Histogram("chat_retention_seconds", "Время прохода архивации")
+
+MESSAGE_COLUMNS = "id, id_in_html, sender, text, room, visibility, timestamp, attachment"
+
+
+def message_record(row) -> Dict:
+    """Строка message из сырого SQL -> запись архива/выгрузки"""
+    return {
+        "id": row.id,
+        "htmlid": row.id_in_html,
+        "sender": row.sender,
+        "text": row.text,
+        "room": row.room,
+        "visibility": bool(row.visibility),
+        "time": datetime.fromisoformat(row.timestamp).isoformat(),
+        "attachment": json.loads(row.attachment) if row.attachment else None,
+    }
+
+
+def archive_dir(room: str) -> Path:
+    # Код комнаты приходит от пользователей, в путь - только экранированным.
+    # "." и ".." quote не трогает - их кодируем явно, иначе путь выходит из ARCHIVE_DIR
+    name = quote(room, safe="")
+    if name in ("", ".", ".."):
+        name = name.replace(".", "%2E") or "%00"
+    directory = ARCHIVE_DIR / name
+    if directory.resolve().parent != ARCHIVE_DIR.resolve():
+        raise ValueError(f"Путь архива вне {ARCHIVE_DIR}: {room!r}")
+    return directory
+
+
+def archive_path(room: str, month: str) -> Path:
+    return archive_dir(room) / f"{month}.ndjson.gz"
+
+
+def archive_months(room: str) -> List[str]:
+    directory = archive_dir(room)
+    if not directory.is_dir():
+        return []
+    return sorted(path.name.split(".", 1)[0] for path in directory.glob("*.ndjson.gz"))
+
+
+def read_archive(room: str, month: str) -> Iterator[Dict]:
+    """
+    Сообщения из архива комнаты за месяц, по порядку.
+
+    Если процесс упал между записью архива и удалением из БД, пачка
+    допишется повторно - дубли отбрасываются по id.
+    """
+    path = archive_path(room, month)
+    if not path.exists():
+        return
+    seen = set()
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        for line in file:
+            record = json.loads(line)
+            if record["id"] in seen:
+                continue
+            seen.add(record["id"])
+            yield record
+
+
+class MessageArchiver:
+    """
+    Уровневое хранение истории чата.
+
+    Свежие сообщения остаются в messages.db, старше политики комнаты -
+    дописываются в archive/<комната>/<ГГГГ-ММ>.ndjson.gz (каждая пачка -
+    отдельный gzip member, файл остаётся обычным .gz) и удаляются из БД.
+    Освободившиеся страницы возвращаются через incremental_vacuum,
+    так что горячая БД не растёт бесконечно.
+    """
+
+    def __init__(
+            self,
+            engine_factory,
+            hot_days: float = RETENTION_HOT_DAYS,
+            room_policies: Optional[Dict[str, float]] = None,
+            max_room_messages: int = RETENTION_MAX_ROOM_MESSAGES,
+            interval: float = RETENTION_INTERVAL_SECONDS,
+            batch_size: int = RETENTION_BATCH_SIZE,
+    ):
+        self.engine_factory = engine_factory
+        self.hot_days = hot_days
+        self.room_policies = parse_rules(RETENTION_ROOM_POLICIES) if room_policies is None else room_policies
+        self.max_room_messages = max_room_messages
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    def init(self):
+        """Индекс для выборки старых сообщений комнаты"""
+        with self.engine_factory().begin() as connection:
+            connection.exec_driver_sql(
+                "CREATE INDEX IF NOT EXISTS ix_message_room_timestamp ON message (room, timestamp)"
+            )
+
+    @staticmethod
+    def _rooms(connection) -> Iterator[str]:
+        # Skip-scan по индексу: O(log n) на комнату вместо SELECT DISTINCT по всей таблице
+        room = connection.exec_driver_sql("SELECT MIN(room) FROM message").scalar()
+        while room is not None:
+            yield room
+            room = connection.exec_driver_sql(
+                "SELECT MIN(room) FROM message WHERE room > ?", (room,)
+            ).scalar()
+
+    def _cutoff(self, connection, room: str, now: datetime) -> str:
+        days = self.room_policies.get(room, self.hot_days)
+        cutoff = (now - timedelta(days=days)).strftime(_SQLITE_TIME_FORMAT)
+        if self.max_room_messages:
+            # Время N-го с конца сообщения: всё, что старше, тоже уходит в архив
+            boundary = connection.exec_driver_sql(
+                "SELECT timestamp FROM message WHERE room = ? ORDER BY timestamp DESC LIMIT 1 OFFSET ?",
+                (room, self.max_room_messages - 1),
+            ).scalar()
+            if boundary is not None and boundary > cutoff:
+                cutoff = boundary
+        return cutoff
+
+    @staticmethod
+    def _write_archive(room: str, rows) -> None:
+        by_month: Dict[str, List[str]] = {}
+        for row in rows:
+            line = json.dumps(message_record(row), ensure_ascii=False) + "\n"
+            by_month.setdefault(row.timestamp[:7], []).append(line)
+
+        for month, lines in by_month.items():
+            path = archive_path(room, month)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "ab") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="ab") as file:
+                    file.write("".join(lines).encode("utf-8"))
+                # Архив должен оказаться на диске раньше, чем строки пропадут из БД
+                raw.flush()
+                os.fsync(raw.fileno())
+
+    def archive_room(self, room: str, now: datetime) -> int:
+        archived = 0
+        engine = self.engine_factory()
+        while True:
+            with engine.begin() as connection:
+                cutoff = self._cutoff(connection, room, now)
+                rows = connection.exec_driver_sql(
+                    f"SELECT {MESSAGE_COLUMNS} FROM message WHERE room = ? AND timestamp < ? "
+                    f"ORDER BY timestamp LIMIT ?",
+                    (room, cutoff, self.batch_size),
+                ).all()
+                if not rows:
+                    break
+                self._write_archive(room, rows)
+                # Триггеры FTS уберут сообщения и из поискового индекса
+                connection.exec_driver_sql(
+                    f"DELETE FROM message WHERE id IN ({','.join('?' * len(rows))})",
+                    tuple(row.id for row in rows),
+                )
+            archived += len(rows)
+            if len(rows) < self.batch_size:
+                break
+        return archived
+
+    def vacuum(self):
+        with self.engine_factory().connect() as connection:
+            if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+                # INCREMENTAL включается только вместе с полным VACUUM, дальше - инкрементально
+                connection.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+                connection.exec_driver_sql("VACUUM")
+                logger.info("Для messages.db включён auto_vacuum=INCREMENTAL")
+            connection.exec_driver_sql(f"PRAGMA incremental_vacuum({RETENTION_VACUUM_PAGES})")
+            connection.exec_driver_sql("PRAGMA optimize")
+
+    @CHAT_RETENTION_SECONDS.time()
+    def run_once(self) -> int:
+        """Один проход по всем комнатам: возвращает число заархивированных сообщений"""
+        now = datetime.utcnow()
+        with self.engine_factory().connect() as connection:
+            rooms = list(self._rooms(connection))
+        archived = 0
+        for room in rooms:
+            count = self.archive_room(room, now)
+            if count:
+                CHAT_ARCHIVED_MESSAGES.inc(count)
+                logger.info("Messages archived", extra={"room": room, "count": count})
+            archived += count
+        self.vacuum()
+        return archived
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                # SQLite и gzip - блокирующие, проход идёт в отдельном потоке
+                await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                logger.error(f"Ошибка архивации сообщений: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,115 @@
+import datetime
+import re
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+
+from metrics import Histogram
+
+SEARCH_MAX_LIMIT = 100
+# Глубже OFFSET в FTS не листаем: каждая страница пересчитывает ранжирование заново
+SEARCH_MAX_OFFSET = 10000
+
+CHAT_SEARCH_SECONDS = Histogram("chat_search_seconds", "Время полнотекстового поиска по истории")
+
+# Внешний контент: текст хранится только в message, в индексе - лишь термы.
+# Скрытые сообщения (visibility = 0) в индекс не попадают, триггеры держат его в актуальном состоянии.
+FTS_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(
+        text, room,
+        content='message', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS message_fts_ai AFTER INSERT ON message WHEN new.visibility BEGIN
+        INSERT INTO message_fts(rowid, text, room) VALUES (new.id, new.text, new.room);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS message_fts_ad AFTER DELETE ON message WHEN old.visibility BEGIN
+        INSERT INTO message_fts(message_fts, rowid, text, room) VALUES ('delete', old.id, old.text, old.room);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS message_fts_au AFTER UPDATE OF text, room, visibility ON message BEGIN
+        INSERT INTO message_fts(message_fts, rowid, text, room)
+            SELECT 'delete', old.id, old.text, old.room WHERE old.visibility;
+        INSERT INTO message_fts(rowid, text, room)
+            SELECT new.id, new.text, new.room WHERE new.visibility;
+    END
+    """,
+]
+
+# Слово из запроса, звёздочка на конце - поиск по префиксу
+_TERM_RE = re.compile(r"\w+\*?")
+
+
+def init_fts(engine):
+    """Создаёт индекс и триггеры; при первом создании индексирует существующую историю"""
+    with engine.begin() as connection:
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_fts'"
+        ).first()
+        for statement in FTS_SCHEMA:
+            connection.exec_driver_sql(statement)
+        if not exists:
+            # 'rebuild' проиндексировал бы и скрытые сообщения
+            connection.exec_driver_sql(
+                "INSERT INTO message_fts(rowid, text, room) SELECT id, text, room FROM message WHERE visibility"
+            )
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace('"', '""') + '"'
+
+
+def build_match_query(room: str, query: str) -> Optional[str]:
+    """
+    Пользовательский запрос -> выражение FTS5.
+
+    Каждое слово берётся в кавычки, поэтому операторы и фильтры по колонкам
+    из ввода не проходят. Все слова обязательны, порядок не важен.
+    """
+    terms = []
+    for term in _TERM_RE.findall(query):
+        word = term.rstrip("*")
+        terms.append(_quote(word) + ("*" if term.endswith("*") else ""))
+    if not terms:
+        return None
+    return f"room : {_quote(room)} AND text : ({' '.join(terms)})"
+
+
+@CHAT_SEARCH_SECONDS.time()
+async def search_messages(engine, room: str, query: str, limit: int, offset: int) -> List[Dict]:
+    """Видимые сообщения комнаты, подходящие под запрос, по убыванию релевантности (bm25)"""
+    match = build_match_query(room, query)
+    if match is None:
+        return []
+    async with engine.connect() as connection:
+        result = await connection.execute(
+            text(
+                """
+                SELECT m.id_in_html, m.sender, m.text, m.room, m.timestamp
+                FROM message_fts
+                JOIN message AS m ON m.id = message_fts.rowid
+                WHERE message_fts MATCH :match AND m.room = :room
+                ORDER BY message_fts.rank, m.id DESC
+                LIMIT :limit OFFSET :offset
+                """
+            ),
+            {"match": match, "room": room, "limit": limit, "offset": offset},
+        )
+        rows = result.all()
+    return [
+        {
+            "htmlid": row.id_in_html,
+            "sender": row.sender,
+            "text": row.text,
+            "room": row.room,
+            # Сырой SQL отдаёт время строкой SQLite, приводим к формату WebSocket-сообщений
+            "time": datetime.datetime.fromisoformat(row.timestamp).isoformat(),
+        }
+        for row in rows
+    ]
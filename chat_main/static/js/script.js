@@ -1,34 +1,182 @@
 const wsProtocol = location.protocol === "https:" ? "wss:" : "ws:";
-const ws = new WebSocket(`${wsProtocol}//${location.host}/main/ws`);
 const messagesDiv = document.getElementById('messages');
 const input = document.getElementById('messageInput');
 const sendBtn = document.getElementById('sendBtn');
+const typingDiv = document.getElementById('typing');
+const fileInput = document.getElementById('fileInput');
+const attachBtn = document.getElementById('attachBtn');
+// Комната, в которую уходят простые сообщения и вложения (первая подписка)
+let currentRoom = null;
 
-ws.onmessage = (event) => {
+// Если сервер не прислал подсказку - переподключаемся со случайной задержкой
+const RECONNECT_MIN_MS = 1000;
+const RECONNECT_SPREAD_MS = 5000;
+let ws = null;
+let reconnectAfterMs = null;
+// ?transport=sse: комната читается через EventSource (для больших аудиторий), отправка - обычным POST
+const useStream = new URLSearchParams(location.search).get('transport') === 'sse';
+// Курсор: время последнего полученного сообщения, при переподключении история догружается с него
+let lastTime = null;
+
+// typing отправляется не чаще раза в TYPING_REPEAT_MS, сервер гасит его сам через несколько секунд
+const TYPING_REPEAT_MS = 3000;
+let lastTypingSent = 0;
+// пользователь -> состояние из кадров state
+const roomUsers = new Map();
+
+function connect() {
+  const query = lastTime ? `?since=${encodeURIComponent(lastTime)}` : '';
+  ws = new WebSocket(`${wsProtocol}//${location.host}/main/ws${query}`);
+  ws.onmessage = onMessage;
+  ws.onclose = (event) => {
+    roomUsers.clear();
+    renderTyping();
+    // 1008 - не авторизован, переподключение не поможет
+    if (event.code === 1008) return;
+    const delay = reconnectAfterMs ?? RECONNECT_MIN_MS + Math.random() * RECONNECT_SPREAD_MS;
+    reconnectAfterMs = null;
+    setTimeout(connect, delay);
+  };
+}
+
+function connectStream() {
+  // Переподключается браузер сам и присылает id последнего кадра в Last-Event-ID
+  const source = new EventSource('/main/stream');
+  source.onmessage = onMessage;
+  source.onerror = () => {
+    roomUsers.clear();
+    renderTyping();
+  };
+}
+
+function onMessage(event) {
   const msg = JSON.parse(event.data);
+  // Сервер перезапускается и сам говорит, когда возвращаться
+  if (msg.type === 'reconnect') {
+    reconnectAfterMs = msg.after_ms;
+    return;
+  }
+  // Кто онлайн и кто печатает: сервер присылает только изменившихся пользователей
+  if (msg.type === 'state') {
+    msg.users.forEach((user) => {
+      if (user.online) roomUsers.set(user.user, user);
+      else roomUsers.delete(user.user);
+    });
+    renderTyping();
+    return;
+  }
+  if (msg.type === 'subscribed') {
+    currentRoom ??= msg.room;
+    return;
+  }
+  if (msg.type === 'unsubscribed') return;
+  if (msg.type === 'error') {
+    console.warn(msg.detail);
+    return;
+  }
+  // Модерация скрыла сообщения - убираем их без перезагрузки истории
+  if (msg.type === 'retract') {
+    msg.htmlids.forEach((htmlid) => document.getElementById(htmlid)?.remove());
+    return;
+  }
+  if (!lastTime || msg.time > lastTime) lastTime = msg.time;
   if (document.getElementById(msg.htmlid)) {
         const p = document.getElementById(msg.htmlid);
-        p.textContent = `${msg.sender}: ${msg.text}`;
+        renderMessage(p, msg);
     } else {
         const p = document.createElement('p');
         p.id = msg.htmlid;
-        p.textContent = `${msg.sender}: ${msg.text}`;
+        renderMessage(p, msg);
         messagesDiv.appendChild(p);
     }
   messagesDiv.scrollTop = messagesDiv.scrollHeight;
-};
+}
+
+function renderMessage(p, msg) {
+  p.textContent = `${msg.sender}: `;
+  if (!msg.attachment) {
+    p.append(msg.text);
+    return;
+  }
+  // Вложение приходит ссылкой, файл скачивается отдельным запросом
+  const link = document.createElement('a');
+  link.href = `/main/attachments/${encodeURIComponent(msg.attachment.id)}`;
+  link.target = '_blank';
+  link.textContent = `📎 ${msg.text}`;
+  p.append(link, ` (${formatSize(msg.attachment.size)})`);
+}
+
+function formatSize(size) {
+  if (size < 1024) return `${size} Б`;
+  if (size < 1024 * 1024) return `${(size / 1024).toFixed(1)} КБ`;
+  return `${(size / 1024 / 1024).toFixed(1)} МБ`;
+}
+
+function renderTyping() {
+  const typing = [...roomUsers.values()].filter((user) => user.typing).map((user) => user.user);
+  typingDiv.textContent = typing.length ? `${typing.join(', ')} печатает…` : '';
+}
+
+function sendEvent(type) {
+  if (ws && ws.readyState === WebSocket.OPEN) {
+    ws.send(JSON.stringify({ type }));
+  }
+}
+
+input.addEventListener('input', () => {
+  const now = Date.now();
+  if (input.value && now - lastTypingSent > TYPING_REPEAT_MS) {
+    lastTypingSent = now;
+    sendEvent('typing');
+  } else if (!input.value && lastTypingSent) {
+    lastTypingSent = 0;
+    sendEvent('stop_typing');
+  }
+});
 
 function sendMessage() {
   const text = input.value.trim();
-  if (text) {
+  if (!text) return;
+  if (useStream) {
+    postChatMessage(text);
+  } else if (ws.readyState === WebSocket.OPEN) {
     ws.send(text);
-    input.value = '';
-    input.focus();
+    // Отправка сообщения на сервере сбрасывает typing
+    lastTypingSent = 0;
+  } else {
+    return;
   }
+  input.value = '';
+  input.focus();
+}
+
+async function postChatMessage(text) {
+  const response = await fetch('/main/messages', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', 'X-Requested-With': 'fetch' },
+    body: JSON.stringify({ room: currentRoom ?? undefined, text }),
+  });
+  if (!response.ok) console.warn(`Не удалось отправить сообщение: ${response.status}`);
 }
 
 sendBtn.onclick = sendMessage;
 
+attachBtn.onclick = () => fileInput.click();
+
+fileInput.addEventListener('change', async () => {
+  const file = fileInput.files[0];
+  fileInput.value = '';
+  if (!file || !currentRoom) return;
+  // Тело запроса - сам файл, браузер отправляет его потоком без multipart
+  const query = `room=${encodeURIComponent(currentRoom)}&filename=${encodeURIComponent(file.name)}`;
+  const response = await fetch(`/main/attachments?${query}`, {
+    method: 'POST',
+    headers: { 'Content-Type': file.type || 'application/octet-stream', 'X-Requested-With': 'fetch' },
+    body: file,
+  });
+  if (!response.ok) console.warn(`Не удалось загрузить файл: ${response.status}`);
+});
+
 input.addEventListener('keydown', (e) => {
   if (e.key === 'Enter') {
     e.preventDefault();
@@ -36,4 +184,6 @@ input.addEventListener('keydown', (e) => {
   }
 });
 
+if (useStream) connectStream();
+else connect();
 input.focus();
\ No newline at end of file
@@ -0,0 +1,160 @@
+import datetime
+import functools
+import logging
+import os
+from typing import List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlmodel import SQLModel, Field, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from validator.html import id_in_html
+
+logger = logging.getLogger(__name__)
+
+DATABASE_PATH = "messages.db"
+# Читающих соединений: загрузка истории, поиск
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", 4))
+# NORMAL в WAL не теряет целостность, только последние транзакции при отключении питания
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 20000))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+# Сколько последних сообщений отдаётся при подключении к комнате
+HISTORY_LIMIT = 50
+
+# Настройки соединения: выставляются один раз, когда пул открывает соединение
+CONNECTION_PRAGMAS = [
+    f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}",
+    f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}",
+    f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}",
+    f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store = MEMORY",
+]
+
+
+# ---------- Модель ----------
+class Message(SQLModel, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    id_in_html: str = Field(default_factory=id_in_html)
+    sender: str
+    text: str
+    room: str = "qwerty"
+    visibility: bool = True
+    timestamp: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+    # JSON-ссылка на вложение {"id", "name", "size", "type"}, сам файл - в attachments
+    attachment: Optional[str] = None
+
+
+class Attachment(SQLModel, table=True):
+    id: str = Field(primary_key=True)
+    sha256: str = Field(index=True)
+    filename: str
+    content_type: str
+    size: int
+    room: str
+    uploader: str
+    created: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+
+
+# ---------- Соединения ----------
+def _apply_pragmas(dbapi_connection, pragmas: List[str]):
+    cursor = dbapi_connection.cursor()
+    for pragma in pragmas:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def _listen_pragmas(engine, pragmas: List[str]):
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        _apply_pragmas(dbapi_connection, pragmas)
+
+
+@functools.lru_cache(maxsize=None)
+def get_engine():
+    """Синхронный движок для работы в потоках: инициализация схемы, архивация, выгрузка"""
+    engine = create_engine(f"sqlite:///{DATABASE_PATH}", echo=False, connect_args={"check_same_thread": False})
+    _listen_pragmas(engine, CONNECTION_PRAGMAS)
+    return engine
+
+
+@functools.lru_cache(maxsize=None)
+def get_write_engine() -> AsyncEngine:
+    """
+    Единственное пишущее соединение: записи выстраиваются в очередь пула,
+    а не конкурируют за блокировку SQLite через busy_timeout.
+    """
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{DATABASE_PATH}",
+        poolclass=AsyncAdaptedQueuePool, pool_size=1, max_overflow=0,
+    )
+    _listen_pragmas(engine.sync_engine, CONNECTION_PRAGMAS)
+    return engine
+
+
+@functools.lru_cache(maxsize=None)
+def get_read_engine() -> AsyncEngine:
+    """Пул читающих соединений: в WAL читатели не ждут писателя"""
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{DATABASE_PATH}",
+        poolclass=AsyncAdaptedQueuePool, pool_size=SQLITE_READ_POOL_SIZE, max_overflow=0,
+    )
+    _listen_pragmas(engine.sync_engine, CONNECTION_PRAGMAS + ["PRAGMA query_only = ON"])
+    return engine
+
+
+def init_storage():
+    """Переводит messages.db в WAL (режим хранится в файле БД) и создаёт таблицы"""
+    engine = get_engine()
+    with engine.connect() as connection:
+        mode = connection.exec_driver_sql("PRAGMA journal_mode = WAL").scalar()
+        if mode != "wal":
+            logger.warning(f"messages.db осталась в режиме журнала {mode}")
+    SQLModel.metadata.create_all(engine)
+    # create_all не добавляет колонки в существующую таблицу
+    with engine.begin() as connection:
+        columns = {row[1] for row in connection.exec_driver_sql("PRAGMA table_info(message)")}
+        if "attachment" not in columns:
+            connection.exec_driver_sql("ALTER TABLE message ADD COLUMN attachment VARCHAR")
+
+
+async def close_storage():
+    for factory in (get_write_engine, get_read_engine):
+        await factory().dispose()
+
+
+# ---------- Запросы горячего пути ----------
+async def load_history(
+        room: str, since: Optional[datetime.datetime] = None, limit: int = HISTORY_LIMIT
+) -> List[Message]:
+    """
+    Последние видимые сообщения комнаты, по возрастанию времени.
+    since - курсор клиента (время последнего полученного сообщения): отдаются только более новые.
+    """
+    statement = select(Message).where(Message.room == room).where(Message.visibility)
+    if since is not None:
+        statement = statement.where(Message.timestamp > since)
+    async with AsyncSession(get_read_engine()) as session:
+        result = await session.exec(statement.order_by(Message.id.desc()).limit(limit))
+        return list(reversed(result.all()))
+
+
+async def save_message(msg: Message):
+    async with AsyncSession(get_write_engine(), expire_on_commit=False) as session:
+        session.add(msg)
+        await session.commit()
+
+
+async def save_attachment(attachment: Attachment):
+    async with AsyncSession(get_write_engine(), expire_on_commit=False) as session:
+        session.add(attachment)
+        await session.commit()
+
+
+async def get_attachment(attachment_id: str) -> Optional[Attachment]:
+    async with AsyncSession(get_read_engine()) as session:
+        return await session.get(Attachment, attachment_id)
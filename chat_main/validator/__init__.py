@@ -1,5 +1,5 @@
 from validator.html import id_in_html
-from validator.processor import process_message
+from validator.processor import load_automaton, process_message, reload_automaton
 
 __version__ = "0.2"
-__all__ = ["id_in_html", "process_message"]
\ No newline at end of file
+__all__ = ["id_in_html", "load_automaton", "process_message", "reload_automaton"]
\ No newline at end of file
@@ -2,11 +2,24 @@ import asyncio
 import logging
 import os
 import re
+import threading
+from collections import OrderedDict
 
 import ahocorasick
 from dataclasses import dataclass
 import importlib.resources as res
 
+from metrics import Counter, Gauge
+
+
+# Кэш результатов проверки: повторяющиеся сообщения ("+", "ок", ссылки) не проверяются заново
+VALIDATION_CACHE_SIZE = int(os.getenv("VALIDATION_CACHE_SIZE", 10000))
+# Длинные сообщения почти не повторяются - в кэш не попадают
+VALIDATION_CACHE_MAX_LENGTH = int(os.getenv("VALIDATION_CACHE_MAX_LENGTH", 256))
+
+CHAT_VALIDATION_CACHE_HITS = Counter("chat_validation_cache_hits_total", "Проверки, взятые из кэша")
+CHAT_VALIDATION_CACHE_MISSES = Counter("chat_validation_cache_misses_total", "Проверки, посчитанные заново")
+CHAT_VALIDATION_CACHE_SIZE = Gauge("chat_validation_cache_size", "Записей в кэше проверки сообщений")
 
 # Регэксп
 ALLOWED_RE = re.compile(r'^[\w\s\-\.\,\!\?\(\)\[\]\{\}\@\#\$\%\^\&\*\:\;\"\'\/\\]+$', re.UNICODE)
@@ -14,6 +27,117 @@ ALLOWED_RE = re.compile(r'^[\w\s\-\.\,\!\?\(\)\[\]\{\}\@\#\$\%\^\&\*\:\;\"\'\/\\
 DISALLOWED_RE = re.compile(r'[^\w\s\-\.\,\!\?\(\)\[\]\{\}\@\#\$\%\^\&\*\:\;\"\'\/\\]', re.UNICODE)
 
 
+# ---------- Нормализация против обхода фильтра ----------
+# Одинаково выглядящие латинские буквы -> кириллица. k/к, u/и и т.п. не склеиваются:
+# "cock" превратился бы в "сосk" и совпал бы с обычным "соска"
+HOMOGLYPHS = {
+    "a": "а", "c": "с", "e": "е", "o": "о", "p": "р", "x": "х", "y": "у",
+    "m": "м", "h": "н", "t": "т", "b": "в",
+    # греческие
+    "α": "а", "ο": "о", "ρ": "р", "τ": "т", "χ": "х", "υ": "у", "κ": "к", "ε": "е",
+    # цифры и символы вместо букв
+    "0": "о", "3": "з", "4": "ч", "6": "б", "@": "а", "$": "s",
+}
+# Знаки, которые стоят только внутри слова ("х*й", "х%й"), выбрасываются всегда
+IGNORED_CHARS = "#%^&*"
+_IGNORED = frozenset(IGNORED_CHARS)
+# Знаки препинания и дефис выбрасываются, только если рядом однобуквенный кусок ("х.у.й", "б-л-я"):
+# между обычными словами это разделитель, иначе "Смех,уйти" склеилось бы в "смехуйти".
+# Пробелы не трогаются никогда
+SEPARATOR_CHARS = "-_.,!?()[]{}:;\"'/\\"
+_SEPARATORS = re.escape(SEPARATOR_CHARS)
+# Обе ветки начинаются с класса знаков (а не с lookbehind) - так re быстро пропускает буквы
+GLUE_RE = re.compile(
+    rf"[{_SEPARATORS}](?<=\w[{_SEPARATORS}])(?<!\w\w[{_SEPARATORS}])[{_SEPARATORS}]*(?=\w)"
+    rf"|[{_SEPARATORS}](?<=\w[{_SEPARATORS}])[{_SEPARATORS}]*(?=\w(?!\w))",
+    re.UNICODE,
+)
+
+
+def build_translation():
+    """
+    Таблица для str.translate: каждый символ переходит ровно в один символ
+    или удаляется, поэтому позицию в нормализованной строке можно вернуть к исходной.
+    Список по кодам символов: translate с ним быстрее, чем со словарём,
+    символы за концом списка остаются как есть.
+    """
+    table = {}
+    letters = "abcdefghijklmnopqrstuvwxyzабвгдеёжзийклмнопрстуфхцчшщъыьэюяαβγδεζηθικλμνξοπρστυφχψω"
+    for ch in letters:
+        lower = HOMOGLYPHS.get(ch, ch)
+        table[ord(ch)] = lower
+        upper = ch.upper()
+        if len(upper) == 1 and upper != ch:
+            table[ord(upper)] = lower
+    for ch, replacement in HOMOGLYPHS.items():
+        table[ord(ch)] = replacement
+    for ch in IGNORED_CHARS:
+        table[ord(ch)] = None
+    translation = [chr(code) for code in range(max(table) + 1)]
+    for code, replacement in table.items():
+        translation[code] = replacement
+    return translation
+
+
+TRANSLATION = build_translation()
+
+
+def normalize(text: str) -> str:
+    return GLUE_RE.sub("", text.translate(TRANSLATION))
+
+
+def offset_map(text: str) -> list[int]:
+    """Индекс исходного символа для каждого символа normalize(text)"""
+    offsets = [i for i, ch in enumerate(text) if ch not in _IGNORED]
+    translated = text.translate(TRANSLATION)
+    glued = set()
+    for match in GLUE_RE.finditer(translated):
+        glued.update(range(match.start(), match.end()))
+    if not glued:
+        return offsets
+    return [offset for j, offset in enumerate(offsets) if j not in glued]
+
+
+class ValidationCache:
+    """
+    LRU: текст сообщения (после strip) -> готовый результат validate_message.
+
+    Попадание обходит нормализацию, оба регэкспа и автомат. Запись
+    действительна только для того автомата, с которым посчитана:
+    после пересборки кэш очищается.
+    """
+
+    def __init__(self, maxsize: int = VALIDATION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries: OrderedDict = OrderedDict()
+        self._automaton = None
+
+    def get(self, automaton, text: str):
+        if automaton is not self._automaton:
+            self.clear()
+            self._automaton = automaton
+        result = self._entries.get(text)
+        if result is None:
+            CHAT_VALIDATION_CACHE_MISSES.inc()
+            return None
+        self._entries.move_to_end(text)
+        CHAT_VALIDATION_CACHE_HITS.inc()
+        return result
+
+    def put(self, text: str, result):
+        self._entries[text] = result
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        CHAT_VALIDATION_CACHE_SIZE.set(len(self._entries))
+
+    def clear(self):
+        self._entries.clear()
+        CHAT_VALIDATION_CACHE_SIZE.set(0)
+
+
+validation_cache = ValidationCache()
+
+
 @dataclass
 class ValidateResult:
     is_valid: bool
@@ -21,21 +145,56 @@ class ValidateResult:
     new_message: str = "not required"
 
 
-# Построение автомата Ахо-Корасика (алгоритм проверки слов)
+# Построение автомата Ахо-Корасика (алгоритм проверки слов).
+# Слова нормализуются той же таблицей, что и сообщения
 def build_automaton(words):
     A = ahocorasick.Automaton()
     for word in words:
-        A.add_word(word, word)
+        word = normalize(word)
+        if word:
+            A.add_word(word, len(word))
     A.make_automaton()
     return A
 
 
-# Берем банворды из data/banwordlist.txt и загружаем в автомат Ахо-Корасика
-BANWORDS = list()
-with res.files("validator.data").joinpath("banwordlist.txt").open("r", encoding="utf-8") as f:
-    for word in f.readlines():
-        BANWORDS.append(word.strip())
-A = build_automaton(BANWORDS)
+# Берем банворды из data/banwordlist.txt и загружаем в автомат Ахо-Корасика.
+# Автомат строится не при импорте, а при старте сервиса (в потоке) или при первой проверке
+_automaton = None
+_automaton_lock = threading.Lock()
+
+
+def load_banwords():
+    banwords = list()
+    with res.files("validator.data").joinpath("banwordlist.txt").open("r", encoding="utf-8") as f:
+        for word in f.readlines():
+            banwords.append(word.strip())
+    return banwords
+
+
+def load_automaton():
+    global _automaton
+    if _automaton is None:
+        with _automaton_lock:
+            if _automaton is None:
+                _automaton = build_automaton(load_banwords())
+    return _automaton
+
+
+def reload_automaton():
+    """Пересобирает автомат из banwordlist.txt (кэш проверок сбросится при следующем обращении)"""
+    global _automaton
+    automaton = build_automaton(load_banwords())
+    with _automaton_lock:
+        _automaton = automaton
+    return automaton
+
+
+async def get_automaton():
+    """Автомат без блокировки event loop: пока его строит фоновый поток, ждём в отдельном потоке"""
+    automaton = _automaton
+    if automaton is None:
+        automaton = await asyncio.to_thread(load_automaton)
+    return automaton
 
 
 # Асинхронный валидатор
@@ -43,6 +202,18 @@ async def validate_message(text: str) -> tuple[bool, str, str]:
     await asyncio.sleep(0)  # не блокируем event loop
 
     text = text.strip()
+    automaton = await get_automaton()
+    if len(text) > VALIDATION_CACHE_MAX_LENGTH:
+        return _validate(text, automaton)
+
+    result = validation_cache.get(automaton, text)
+    if result is None:
+        result = _validate(text, automaton)
+        validation_cache.put(text, result)
+    return result
+
+
+def _validate(text: str, automaton) -> tuple[bool, str, str]:
     if not text:
         return (False, "Пустое сообщение", " ")
 
@@ -50,14 +221,20 @@ async def validate_message(text: str) -> tuple[bool, str, str]:
         sanitized_text = DISALLOWED_RE.sub(" ", text)
         return (False, "Недопустимые символы", sanitized_text)
 
-    lowered = text.lower()
-    text = list(text)
-    is_correct = True
-    for i, found in A.iter(lowered):
-        is_correct = False
-        text[(i+1)-len(found):(i+1)] = "*"*len(found)
-    if not is_correct:
-        text = "".join(text)
+    # Один проход автомата по нормализованному тексту
+    normalized = normalize(text)
+    matches = list(automaton.iter(normalized))
+    if matches:
+        # Без удалённых знаков позиции совпадают, иначе переводим через карту смещений
+        offsets = offset_map(text) if len(normalized) != len(text) else None
+        censored = list(text)
+        for end, length in matches:
+            start = end + 1 - length
+            if offsets is not None:
+                start, end = offsets[start], offsets[end]
+            # Закрывается исходный фрагмент целиком, вместе со вставленными знаками
+            censored[start:end + 1] = "*" * (end + 1 - start)
+        text = "".join(censored)
         return (False, f"Найдены ban-слова. Цензура: {text}", text)
 
     return (True, "OK", "-")
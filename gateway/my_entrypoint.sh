@@ -2,7 +2,7 @@
 set -e
 
 # Подставляем переменные в основной конфиг
-VARS='$NGINX_SERVER_NAMES $NGINX_DOMAIN'
+VARS='$NGINX_SERVER_NAMES $NGINX_DOMAIN $ACCESS_COOKIE_NAME'
 envsubst "$VARS" < /usr/local/bin/nginx.conf.template > /etc/nginx/nginx.conf
 
 # Генерируем ssl.conf только если сертификаты указаны
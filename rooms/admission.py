@@ -0,0 +1,155 @@
+import asyncio
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import AsyncGenerator, Dict, Set, Tuple
+
+from presence import PresenceRegistry, presence
+
+logger = logging.getLogger(__name__)
+
+# Интервал keep-alive комментариев в SSE, чтобы прокси не рвали соединение
+SSE_KEEPALIVE_SECONDS = 15
+# Сколько место в очереди ждёт ожидающего без открытого SSE (перезагрузка страницы, обрыв сети)
+QUEUE_GRACE_SECONDS = float(os.getenv("QUEUE_GRACE_SECONDS", 30))
+
+
+class WaitingList:
+    """
+    Очередь ожидания для заполненных комнат.
+
+    Вход в комнату решается без БД: вместимость запоминается при первом
+    обращении к странице комнаты, занятость берётся из реестра присутствия.
+    Когда место освобождается, первый в очереди получает зарезервированное
+    место (join в presence с обычным TTL) и событие "admitted" по SSE.
+    """
+
+    def __init__(self, registry: PresenceRegistry):
+        self.presence = registry
+        # room -> {user -> set очередей SSE-подписчиков}
+        self._queues: Dict[str, "OrderedDict[str, Set[asyncio.Queue]]"] = {}
+        self._capacity: Dict[str, int] = {}
+        self._admitting: Set[str] = set()
+        # (room, user) -> отложенное удаление из очереди, пока нет ни одного SSE-подписчика
+        self._expiry: Dict[Tuple[str, str], asyncio.TimerHandle] = {}
+        registry.add_listener(self._on_presence_change)
+
+    def set_capacity(self, room: str, capacity: int):
+        self._capacity[room] = capacity
+
+    def try_admit(self, room: str, user: str) -> bool:
+        """Пускает в комнату, если участник уже внутри или есть место и нет очереди"""
+        if self.presence.is_present(room, user):
+            return True
+        if self.presence.count(room) >= self._capacity.get(room, 0) or self._queues.get(room):
+            return False
+        self.presence.join(room, user)
+        return True
+
+    def enqueue(self, room: str, user: str) -> int:
+        """Ставит в очередь (если ещё не стоит), возвращает позицию начиная с 1"""
+        queue = self._queues.setdefault(room, OrderedDict())
+        if not queue.setdefault(user, set()):
+            # Страница ожидания ещё не подключилась - место держится QUEUE_GRACE_SECONDS
+            self._schedule_expiry(room, user)
+        return self.position(room, user)
+
+    def position(self, room: str, user: str) -> int:
+        queue = self._queues.get(room)
+        if not queue or user not in queue:
+            return 0
+        for index, waiting_user in enumerate(queue, start=1):
+            if waiting_user == user:
+                return index
+        return 0
+
+    def _schedule_expiry(self, room: str, user: str):
+        self._cancel_expiry(room, user)
+        loop = asyncio.get_running_loop()
+        self._expiry[(room, user)] = loop.call_later(QUEUE_GRACE_SECONDS, self._expire, room, user)
+
+    def _cancel_expiry(self, room: str, user: str):
+        handle = self._expiry.pop((room, user), None)
+        if handle is not None:
+            handle.cancel()
+
+    def _expire(self, room: str, user: str):
+        self._expiry.pop((room, user), None)
+        subscribers = self._queues.get(room, {}).get(user)
+        # Вернулся за время ожидания - место остаётся
+        if subscribers is not None and not subscribers:
+            self.remove(room, user)
+
+    def remove(self, room: str, user: str):
+        self._cancel_expiry(room, user)
+        queue = self._queues.get(room)
+        if not queue or user not in queue:
+            return
+        del queue[user]
+        if not queue:
+            del self._queues[room]
+        self._publish_positions(room)
+
+    def _send(self, room: str, user: str, event: Dict):
+        frame = f"data: {json.dumps(event)}\n\n"
+        for subscriber in self._queues.get(room, {}).get(user, ()):
+            subscriber.put_nowait(frame)
+
+    def _publish_positions(self, room: str):
+        for index, user in enumerate(self._queues.get(room, ()), start=1):
+            self._send(room, user, {"type": "position", "position": index})
+
+    def _on_presence_change(self, room: str, count: int):
+        queue = self._queues.get(room)
+        # join ниже снова вызывает этот обработчик - вложенный вызов пропускаем
+        if not queue or room in self._admitting:
+            return
+        self._admitting.add(room)
+        try:
+            while queue and self.presence.count(room) < self._capacity.get(room, 0):
+                user = next(iter(queue))
+                self._send(room, user, {"type": "admitted"})
+                del queue[user]
+                self._cancel_expiry(room, user)
+                self.presence.join(room, user)
+        finally:
+            self._admitting.discard(room)
+        if not queue:
+            self._queues.pop(room, None)
+        self._publish_positions(room)
+
+    async def events(self, room: str, user: str) -> AsyncGenerator[str, None]:
+        """SSE-поток позиции в очереди для одного ожидающего"""
+        if self.presence.is_present(room, user):
+            yield f"data: {json.dumps({'type': 'admitted'})}\n\n"
+            return
+        if self.position(room, user) == 0:
+            yield f"data: {json.dumps({'type': 'expired'})}\n\n"
+            return
+
+        subscriber: asyncio.Queue = asyncio.Queue()
+        self._queues[room][user].add(subscriber)
+        self._cancel_expiry(room, user)
+        try:
+            yield f"data: {json.dumps({'type': 'position', 'position': self.position(room, user)})}\n\n"
+            while True:
+                try:
+                    frame = await asyncio.wait_for(subscriber.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield frame
+                if '"admitted"' in frame:
+                    return
+        finally:
+            subscribers = self._queues.get(room, {}).get(user)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                # Последний SSE закрылся - место освобождается, только если за
+                # QUEUE_GRACE_SECONDS не переподключится (перезагрузка, обрыв сети)
+                if not subscribers:
+                    self._schedule_expiry(room, user)
+
+
+waiting_list = WaitingList(presence)
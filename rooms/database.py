@@ -1,4 +1,6 @@
+import asyncio
 import random
+from datetime import datetime, timezone
 from tortoise import Tortoise, fields
 from tortoise.models import Model
 from tortoise.transactions import in_transaction
@@ -6,12 +8,31 @@ from contextlib import asynccontextmanager
 from typing import List, Dict, Any, Optional, AsyncGenerator
 from tortoise.exceptions import DoesNotExist
 import logging
+import os
+
+from key import generation_keys
+from metrics import Histogram
 
 
 logger = logging.getLogger(__name__)
 
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "Время запросов репозитория к БД", ["query"])
+
 # Константы
 DB_URL = 'sqlite://{name_db}.db'
+# Mesh WebRTC: каждый участник умножает исходящий трафик остальных
+DEFAULT_ROOM_CAPACITY = int(os.getenv("DEFAULT_ROOM_CAPACITY", 6))
+
+# Колонки, добавленные после первого релиза: в уже созданных БД докатываем их через ALTER TABLE
+MIGRATION_COLUMNS = {
+    "rooms": {
+        "capacity": f"INT NOT NULL DEFAULT {DEFAULT_ROOM_CAPACITY}",
+        "last_activity": "TIMESTAMP",
+    },
+}
+MIGRATION_INDEXES = {
+    "idx_rooms_last_activity": "rooms (last_activity)",
+}
 
 
 class DatabaseManager:
@@ -21,6 +42,27 @@ class DatabaseManager:
         self.db_name = db_name
         self.db_url = f'sqlite://{db_name}'
         self._initialized = False
+        self._migrated = False
+        # Сессии считаются: соединения закрывает только последняя активная,
+        # иначе фоновые задачи и параллельные запросы закрывали бы соединения друг у друга
+        self._active_sessions = 0
+        self._lock = asyncio.Lock()
+
+    async def migrate_columns(self):
+        """Добавление недостающих колонок в существующие таблицы (один раз за процесс)"""
+        if self._migrated:
+            return
+        connection = Tortoise.get_connection("default")
+        for table, columns in MIGRATION_COLUMNS.items():
+            rows = await connection.execute_query_dict(f"PRAGMA table_info({table})")
+            existing = {row["name"] for row in rows}
+            for column, ddl in columns.items():
+                if column not in existing:
+                    await connection.execute_script(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+                    logger.info(f"Добавлена колонка {table}.{column}")
+        for index, target in MIGRATION_INDEXES.items():
+            await connection.execute_script(f"CREATE INDEX IF NOT EXISTS {index} ON {target}")
+        self._migrated = True
 
     async def init_db(self):
         """Инициализация базы данных и подключение к ней"""
@@ -36,6 +78,7 @@ class DatabaseManager:
                 modules={"models": ["database"]},
             )
             await Tortoise.generate_schemas()
+            await self.migrate_columns()
             self._initialized = True
             logger.info(f"База данных {self.db_name} успешно инициализирована")
         except Exception as e:
@@ -52,14 +95,23 @@ class DatabaseManager:
     @asynccontextmanager
     async def session(self):
         """Контекстный менеджер для сессии БД"""
+        async with self._lock:
+            self._active_sessions += 1
+            try:
+                await self.init_db()
+            except Exception:
+                self._active_sessions -= 1
+                raise
         try:
-            await self.init_db()
             yield
         except Exception as e:
             logger.error(f"Ошибка в сессии БД: {e}")
             raise
         finally:
-            await self.close_db()
+            async with self._lock:
+                self._active_sessions -= 1
+                if self._active_sessions == 0:
+                    await self.close_db()
 
     @asynccontextmanager
     async def transaction(self):
@@ -97,10 +149,14 @@ class Room(Model):
     """
     title - название
     code - сгенерированный код
+    capacity - максимальное число участников звонка
+    last_activity - время последней активности (обновляется пачками)
     """
     id = fields.IntField(pk=True)
     title = fields.CharField(max_length=255, default="Комната")
     code = fields.CharField(max_length=8, unique=True)
+    capacity = fields.IntField(default=DEFAULT_ROOM_CAPACITY)
+    last_activity = fields.DatetimeField(null=True)
 
     class Meta:
         table = "rooms"
@@ -114,8 +170,27 @@ class Room(Model):
             "id": self.id,
             "title": self.title,
             "code": self.code,
+            "capacity": self.capacity,
         }
 
+class RoomArchive(Model):
+    """
+    Комнаты, удалённые чистильщиком за неактивность
+    """
+    id = fields.IntField(pk=True)
+    title = fields.CharField(max_length=255)
+    code = fields.CharField(max_length=8, index=True)
+    capacity = fields.IntField()
+    last_activity = fields.DatetimeField(null=True)
+    archived_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "rooms_archive"
+
+    def __str__(self):
+        return f"RoomArchive({self.id}: {self.code})"
+
+
 # ---------------------
 # CRUD операции для Rooms
 # ---------------------
@@ -123,20 +198,24 @@ class RoomRepository:
     """Репозиторий для работы с комнатами"""
 
     @staticmethod
+    @DB_QUERY_SECONDS.time(query="create_room")
     async def create_room(
             title: str,
-            code: str
+            code: str,
+            capacity: int = DEFAULT_ROOM_CAPACITY
     ) -> Room:
         """Создание новой комнаты"""
         async with db_manager.session():
             room = await Room.create(
                 title=title,
-                code=code
+                code=code,
+                capacity=capacity
             )
             logger.info(f'Создана комната: {room.code}')
             return room
 
     @staticmethod
+    @DB_QUERY_SECONDS.time(query="get_room_by_id")
     async def get_room_by_id(room_id: int):
         """Получение комнаты по ID"""
         async with db_manager.session():
@@ -147,6 +226,7 @@ class RoomRepository:
                 return None
 
     @staticmethod
+    @DB_QUERY_SECONDS.time(query="get_room_by_code")
     async def get_room_by_code(code: str):
         """Получение комнаты по CODE"""
         async with db_manager.session():
@@ -157,6 +237,14 @@ class RoomRepository:
                 return None
 
     @staticmethod
+    @DB_QUERY_SECONDS.time(query="get_rooms_by_codes")
+    async def get_rooms_by_codes(codes: List[str]) -> List[Room]:
+        """Получение нескольких комнат по кодам одним запросом"""
+        async with db_manager.session():
+            return await Room.filter(code__in=codes)
+
+    @staticmethod
+    @DB_QUERY_SECONDS.time(query="delete_room")
     async def delete_room(room_id: int) -> bool:
         """Удаление комнаты"""
         async with db_manager.session():
@@ -165,4 +253,93 @@ class RoomRepository:
                 await user.delete()
                 logger.info(f"Удалена комната: {user.title}")
                 return True
-            return False
\ No newline at end of file
+            return False
+
+    @staticmethod
+    @DB_QUERY_SECONDS.time(query="bulk_create_rooms")
+    async def bulk_create_rooms(rooms_data: List[Dict[str, Any]]) -> List[Room]:
+        """Создание пачки комнат (title, capacity) одной транзакцией, коды выдаются аллокатором"""
+        async with db_manager.transaction() as connection:
+            codes: List[str] = []
+            # Перегенерируем только те коды, что уже заняты в БД
+            while len(codes) < len(rooms_data):
+                candidates = generation_keys(len(rooms_data) - len(codes), exclude=codes)
+                taken = set(
+                    await Room.filter(code__in=candidates).using_db(connection).values_list("code", flat=True)
+                )
+                codes.extend(code for code in candidates if code not in taken)
+
+            rooms = [Room(code=code, **data) for data, code in zip(rooms_data, codes)]
+            await Room.bulk_create(rooms, using_db=connection)
+            logger.info(f"Создано комнат пакетом: {len(rooms)}")
+            return rooms
+
+    @staticmethod
+    @DB_QUERY_SECONDS.time(query="bulk_delete_rooms")
+    async def bulk_delete_rooms(codes: List[str]) -> Dict[str, bool]:
+        """Удаление пачки комнат по кодам одной транзакцией"""
+        async with db_manager.transaction() as connection:
+            existing = set(
+                await Room.filter(code__in=codes).using_db(connection).values_list("code", flat=True)
+            )
+            if existing:
+                await Room.filter(code__in=list(existing)).using_db(connection).delete()
+            logger.info(f"Удалено комнат пакетом: {len(existing)}")
+            return {code: code in existing for code in codes}
+
+    @staticmethod
+    @DB_QUERY_SECONDS.time(query="touch_rooms")
+    async def touch_rooms(codes: List[str], moment: datetime) -> int:
+        """Пакетное обновление last_activity одним UPDATE"""
+        async with db_manager.session():
+            return await Room.filter(code__in=codes).update(last_activity=moment)
+
+    @staticmethod
+    @DB_QUERY_SECONDS.time(query="sweep_idle_rooms")
+    async def sweep_idle_rooms(cutoff: datetime, limit: int, exclude: List[str], archive: bool) -> List[str]:
+        """Удаление (или перенос в архив) одной пачки комнат, неактивных с cutoff"""
+        async with db_manager.transaction() as connection:
+            # У комнат без отметки активности отсчёт TTL начинается с текущего прохода
+            await Room.filter(last_activity=None).using_db(connection).update(
+                last_activity=datetime.now(timezone.utc)
+            )
+            rooms = await (
+                Room.filter(last_activity__lt=cutoff)
+                .exclude(code__in=exclude)
+                .using_db(connection)
+                .order_by("last_activity")
+                .limit(limit)
+            )
+            if not rooms:
+                return []
+            if archive:
+                await RoomArchive.bulk_create(
+                    [
+                        RoomArchive(
+                            title=room.title,
+                            code=room.code,
+                            capacity=room.capacity,
+                            last_activity=room.last_activity,
+                        )
+                        for room in rooms
+                    ],
+                    using_db=connection,
+                )
+            await Room.filter(id__in=[room.id for room in rooms]).using_db(connection).delete()
+            logger.info(f"Удалено неактивных комнат: {len(rooms)}")
+            return [room.code for room in rooms]
+
+    @staticmethod
+    @DB_QUERY_SECONDS.time(query="compact")
+    async def compact():
+        """Возврат свободных страниц SQLite и обновление статистики планировщика"""
+        async with db_manager.session():
+            connection = Tortoise.get_connection("default")
+            rows = await connection.execute_query_dict("PRAGMA auto_vacuum")
+            if rows and rows[0]["auto_vacuum"] != 2:
+                # INCREMENTAL включается только вместе с полным VACUUM, дальше - инкрементально
+                await connection.execute_script("PRAGMA auto_vacuum = INCREMENTAL")
+                await connection.execute_script("VACUUM")
+                logger.info("Для rooms.db включён auto_vacuum=INCREMENTAL")
+            await connection.execute_script("PRAGMA incremental_vacuum")
+            await connection.execute_script("PRAGMA optimize")
@@ -1,5 +1,20 @@
 import random
 
+KEY_MIN = 10000000
+KEY_MAX = 99999999
+
+
 def generation_key():
-    key = random.randint(10000000, 99999999)
-    return key
\ No newline at end of file
+    key = random.randint(KEY_MIN, KEY_MAX)
+    return key
+
+
+def generation_keys(count: int, exclude=()) -> list[str]:
+    """Генерация count различных кодов комнат, не входящих в exclude"""
+    exclude = set(exclude)
+    keys = set()
+    while len(keys) < count:
+        key = str(generation_key())
+        if key not in exclude:
+            keys.add(key)
+    return list(keys)
@@ -1,28 +1,69 @@
+from startup import startup_report, LazyTemplates, install_startup
+
 from pathlib import Path
 
-from fastapi import FastAPI, Request, HTTPException, Form, Depends
-from fastapi.middleware import Middleware
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
-from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
-from starlette.status import HTTP_303_SEE_OTHER
+with startup_report.measure("fastapi"):
+    from fastapi import FastAPI, Request, HTTPException, Form, Depends, Query, Header, Response
+    from fastapi.middleware import Middleware
+    from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
+    from fastapi.staticfiles import StaticFiles
+    from starlette.status import HTTP_303_SEE_OTHER
 
-from database import RoomRepository
+with startup_report.measure("database"):
+    from database import RoomRepository, DEFAULT_ROOM_CAPACITY
 room_repository = RoomRepository()
 
-from key import generation_key
+with startup_report.measure("service modules"):
+    from key import generation_key
+
+    from jwtapi import get_current_user, get_current_admin, AuthMiddleware
+
+    from schemas import BulkCreateIn, BulkDeleteIn, MAX_ROOM_CAPACITY
+
+    from presence import presence, user_key
+
+    from admission import waiting_list
+
+    from sweeper import activity_tracker, room_sweeper
+
+    from metadata import room_metadata, etag_matches
 
-from jwtapi import get_current_user, AuthMiddleware
+    from turn import turn_credentials
 
-app = FastAPI(title="Комнаты", middleware=[Middleware(AuthMiddleware)])
+    from metrics import MetricsMiddleware, metrics_endpoint
+    from profiling import ProfilingMiddleware, install_profiling
+
+room_sweeper.add_listener(room_metadata.forget)
+
+app = FastAPI(title="Комнаты", middleware=[Middleware(MetricsMiddleware), Middleware(AuthMiddleware), Middleware(ProfilingMiddleware)])
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+install_profiling(app)
+install_startup(app)
 # Получаем абсолютный путь к директории проекта
 BASE_DIR = Path(__file__).parent
 
 # Подключаем статические файлы с абсолютными путями
 app.mount("/static", StaticFiles(directory=BASE_DIR / "static"), name="static")
 
-# Подключаем шаблоны
-templates = Jinja2Templates(directory=BASE_DIR / "templates")
+# Подключаем шаблоны (jinja2 импортируется при старте в фоне)
+templates = LazyTemplates(BASE_DIR / "templates")
+
+
+@app.on_event("startup")
+async def on_startup():
+    with startup_report.measure("background tasks", kind="init"):
+        presence.start()
+        activity_tracker.start()
+        room_sweeper.start()
+    startup_report.build_in_background("templates", templates.load)
+    startup_report.finish_startup()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await room_sweeper.stop()
+    await activity_tracker.stop()
+    await presence.stop()
 
 
 @app.get("/create_room", response_class=HTMLResponse)
@@ -33,6 +74,7 @@ async def index(request: Request):
         {
             "request": request,
             "key": key,
+            "capacity": DEFAULT_ROOM_CAPACITY,
             "title": "Создание комнаты"
         }
     )
@@ -43,17 +85,46 @@ async def index(request: Request):
 async def create_room(
         request: Request,
         title: str = Form(...),
-        code: str = Form(...)
+        code: str = Form(...),
+        capacity: int = Form(DEFAULT_ROOM_CAPACITY, ge=1, le=MAX_ROOM_CAPACITY)
 ):
         room_record = await room_repository.create_room(
             title=title,
-            code=code
+            code=code,
+            capacity=capacity
         )
         room_dict = room_record.to_dict()
         # Перенаправляем на домашнюю страницу
         return RedirectResponse(url=f"/rooms/room/{room_dict['code']}", status_code=HTTP_303_SEE_OTHER)
 
 
+# Пакетное создание комнат (JSON API для админов)
+@app.post("/bulk/create_rooms")
+async def bulk_create_rooms(payload: BulkCreateIn, current_user_data: dict = Depends(get_current_admin)):
+    rooms = await room_repository.bulk_create_rooms([room.model_dump() for room in payload.rooms])
+    return {
+        "created": len(rooms),
+        "results": [
+            {"title": room.title, "code": room.code, "capacity": room.capacity, "status": "created"}
+            for room in rooms
+        ],
+    }
+
+
+# Пакетное удаление комнат по кодам
+@app.post("/bulk/delete_rooms")
+async def bulk_delete_rooms(payload: BulkDeleteIn, current_user_data: dict = Depends(get_current_admin)):
+    deleted = await room_repository.bulk_delete_rooms(payload.codes)
+    room_metadata.forget(code for code, is_deleted in deleted.items() if is_deleted)
+    return {
+        "deleted": sum(deleted.values()),
+        "results": [
+            {"code": code, "status": "deleted" if is_deleted else "not_found"}
+            for code, is_deleted in deleted.items()
+        ],
+    }
+
+
 # Проверка существования комнаты
 @app.get("/room_exists/{code}")
 async def room_exists(code: str):
@@ -71,7 +142,150 @@ async def room_page(request: Request, code: str, current_user_data: dict = Depen
     room = await room_repository.get_room_by_code(code)
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
-    return templates.TemplateResponse("room.html", {"request": request, "room_code": code})
+
+    # Допуск в mesh-звонок: при заполненной комнате - очередь ожидания
+    user = user_key(current_user_data)
+    activity_tracker.touch(code)
+    waiting_list.set_capacity(code, room.capacity)
+    if not waiting_list.try_admit(code, user):
+        return templates.TemplateResponse(
+            "room_full.html",
+            {
+                "request": request,
+                "room_code": code,
+                "room_title": room.title,
+                "capacity": room.capacity,
+                "position": waiting_list.enqueue(code, user),
+                "title": "Комната заполнена",
+            }
+        )
+
+    return templates.TemplateResponse(
+        "room.html",
+        {
+            "request": request,
+            "room_code": code,
+            "room_title": room.title,
+            "participants": presence.count(code),
+            "capacity": room.capacity,
+        }
+    )
+
+
+# ---------- JSON-метаданные комнат для polling-клиентов ----------
+@app.get("/api/room/{code}")
+async def room_metadata_api(code: str, if_none_match: str | None = Header(default=None)):
+    # Закешированная неизменившаяся комната - 304 без обращения к БД
+    if room_metadata.is_cached(code) and etag_matches(if_none_match, room_metadata.etag(code)):
+        return Response(status_code=304, headers={"ETag": room_metadata.etag(code)})
+
+    if not room_metadata.is_cached(code):
+        room = await room_repository.get_room_by_code(code)
+        if not room:
+            return JSONResponse(status_code=404, content={"detail": "Room not found"})
+        room_metadata.store(room.to_dict())
+
+    return JSONResponse(
+        content=room_metadata.get(code),
+        headers={"ETag": room_metadata.etag(code), "Cache-Control": "no-cache"},
+    )
+
+
+# Пакетный вариант: /api/rooms?codes=123,456
+@app.get("/api/rooms")
+async def rooms_metadata_api(
+        codes: str = Query(..., max_length=9000),
+        if_none_match: str | None = Header(default=None)
+):
+    code_list = list(dict.fromkeys(code for code in codes.split(",") if code))
+    missing = [code for code in code_list if not room_metadata.is_cached(code)]
+    if not missing and etag_matches(if_none_match, room_metadata.batch_etag(code_list)):
+        return Response(status_code=304, headers={"ETag": room_metadata.batch_etag(code_list)})
+
+    if missing:
+        for room in await room_repository.get_rooms_by_codes(missing):
+            room_metadata.store(room.to_dict())
+
+    rooms = {}
+    not_found = []
+    for code in code_list:
+        meta = room_metadata.get(code)
+        if meta is None:
+            not_found.append(code)
+        else:
+            rooms[code] = meta
+    return JSONResponse(
+        content={"rooms": rooms, "not_found": not_found},
+        headers={"ETag": room_metadata.batch_etag(code_list), "Cache-Control": "no-cache"},
+    )
+
+
+# Временный TURN-пароль участника комнаты (coturn use-auth-secret)
+@app.get("/api/room/{code}/turn")
+async def room_turn_credentials(code: str, current_user_data: dict = Depends(get_current_user)):
+    if not turn_credentials.configured:
+        raise HTTPException(status_code=503, detail="TURN is not configured")
+    user = user_key(current_user_data)
+    # Релей - только допущенным в комнату, а не любому с токеном
+    if not presence.is_present(code, user):
+        raise HTTPException(status_code=403, detail="Not in room")
+    return JSONResponse(turn_credentials.issue(user, code), headers={"Cache-Control": "private, no-store"})
+
+
+# SSE-поток позиции в очереди ожидания
+@app.get("/room/{code}/queue")
+async def room_queue(code: str, current_user_data: dict = Depends(get_current_user)):
+    return StreamingResponse(
+        waiting_list.events(code, user_key(current_user_data)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Счётчики для живой панели администратора (auth_reg опрашивает раз в тик, в gateway закрыт)
+@app.get("/stats", include_in_schema=False)
+async def stats():
+    counts = presence.counts(presence.rooms())
+    return {"active_rooms": len(counts), "participants": sum(counts.values())}
+
+
+# ---------- Присутствие участников ----------
+@app.post("/presence/{code}/join")
+async def presence_join(code: str, current_user_data: dict = Depends(get_current_user)):
+    room = await room_repository.get_room_by_code(code)
+    if not room:
+        # JSONResponse, а не HTTPException: глобальный обработчик превращает 404 в редирект
+        return JSONResponse(status_code=404, content={"detail": "Room not found"})
+    # Вход - по тем же правилам, что страница комнаты: вместимость и очередь ожидания
+    user = user_key(current_user_data)
+    waiting_list.set_capacity(code, room.capacity)
+    if not waiting_list.try_admit(code, user):
+        return JSONResponse(
+            status_code=409,
+            content={"detail": "Room is full", "position": waiting_list.enqueue(code, user)},
+        )
+    return {"code": code, "count": presence.count(code)}
+
+
+@app.post("/presence/{code}/heartbeat")
+async def presence_heartbeat(code: str, current_user_data: dict = Depends(get_current_user)):
+    # Heartbeat не ходит в БД: если участник уже истёк, клиент делает повторный join
+    if not presence.heartbeat(code, user_key(current_user_data)):
+        return JSONResponse(status_code=409, content={"detail": "Not joined"})
+    activity_tracker.touch(code)
+    return {"code": code, "count": presence.count(code)}
+
+
+@app.post("/presence/{code}/leave")
+async def presence_leave(code: str, current_user_data: dict = Depends(get_current_user)):
+    count = presence.leave(code, user_key(current_user_data))
+    return {"code": code, "count": count}
+
+
+# Число участников в одной или нескольких комнатах: /presence?codes=123,456
+@app.get("/presence")
+async def presence_counts(codes: str = Query(..., max_length=9000)):
+    return {"counts": presence.counts(code for code in codes.split(",") if code)}
 
 
 @app.exception_handler(HTTPException)
@@ -0,0 +1,73 @@
+import hashlib
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from presence import PresenceRegistry, presence
+
+
+class RoomMetadataCache:
+    """
+    Метаданные комнат для polling-клиентов с условными GET.
+
+    Каждой комнате соответствует счётчик версий: он растёт при изменении
+    занятости (через подписку на реестр присутствия) и при удалении комнаты.
+    ETag строится из эпохи процесса и версии, поэтому If-None-Match для
+    закешированной комнаты проверяется целиком в памяти, без запроса в БД.
+    """
+
+    def __init__(self, registry: PresenceRegistry):
+        self.presence = registry
+        # Эпоха отличает ETag-и разных запусков процесса, где счётчики начинаются заново
+        self.epoch = format(time.time_ns(), "x")
+        self._versions: Dict[str, int] = {}
+        # code -> неизменяемая часть метаданных из БД (title, code, capacity)
+        self._rooms: Dict[str, Dict[str, Any]] = {}
+        registry.add_listener(self._on_presence_change)
+
+    def _on_presence_change(self, room: str, count: int):
+        self.bump(room)
+
+    def bump(self, code: str):
+        self._versions[code] = self._versions.get(code, 0) + 1
+
+    def store(self, room: Dict[str, Any]):
+        self._rooms[room["code"]] = {
+            "title": room["title"],
+            "code": room["code"],
+            "capacity": room["capacity"],
+        }
+
+    def forget(self, codes: Iterable[str]):
+        for code in codes:
+            self._rooms.pop(code, None)
+            self.bump(code)
+
+    def is_cached(self, code: str) -> bool:
+        return code in self._rooms
+
+    def get(self, code: str) -> Optional[Dict[str, Any]]:
+        room = self._rooms.get(code)
+        if room is None:
+            return None
+        return {**room, "occupancy": self.presence.count(code)}
+
+    def etag(self, code: str) -> str:
+        return f'"{self.epoch}-{code}-{self._versions.get(code, 0)}"'
+
+    def batch_etag(self, codes: List[str]) -> str:
+        versions = ",".join(f"{code}:{self._versions.get(code, 0)}" for code in sorted(codes))
+        digest = hashlib.blake2b(versions.encode(), digest_size=12).hexdigest()
+        return f'"{self.epoch}-{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Проверка If-None-Match (в том числе списка тегов и слабых W/ тегов)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in tags
+
+
+room_metadata = RoomMetadataCache(presence)
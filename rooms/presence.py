@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import math
+import os
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд без heartbeat участник считается вышедшим
+PRESENCE_TTL_SECONDS = float(os.getenv("PRESENCE_TTL_SECONDS", 30))
+# Шаг колеса таймеров
+PRESENCE_TICK_SECONDS = float(os.getenv("PRESENCE_TICK_SECONDS", 1))
+
+
+class PresenceRegistry:
+    """
+    Реестр участников комнат в памяти процесса.
+
+    Истечение по TTL сделано через колесо таймеров (timing wheel): участник лежит
+    в слоте, до которого стрелка дойдёт через TTL. Heartbeat переносит его в новый
+    слот за O(1), тик истекает только один слот, без обхода всех участников.
+    Число участников комнаты - это len() словаря, т.е. тоже O(1).
+    """
+
+    def __init__(self, ttl: float = PRESENCE_TTL_SECONDS, tick: float = PRESENCE_TICK_SECONDS):
+        self.tick = tick
+        self.ttl_ticks = max(1, math.ceil(ttl / tick))
+        self._wheel: list[Set[Tuple[str, str]]] = [set() for _ in range(self.ttl_ticks + 1)]
+        self._position = 0
+        # room -> {user -> индекс слота в колесе}
+        self._rooms: Dict[str, Dict[str, int]] = {}
+        self._task: Optional[asyncio.Task] = None
+        # Подписчики на изменение числа участников: callback(room, count)
+        self._listeners: List[Callable[[str, int], None]] = []
+
+    def add_listener(self, callback: Callable[[str, int], None]):
+        self._listeners.append(callback)
+
+    def _notify(self, room: str):
+        count = self.count(room)
+        for callback in self._listeners:
+            try:
+                callback(room, count)
+            except Exception as e:
+                logger.error(f"Ошибка в подписчике присутствия: {e}")
+
+    def _schedule(self, room: str, user: str) -> int:
+        slot = (self._position + self.ttl_ticks) % len(self._wheel)
+        self._wheel[slot].add((room, user))
+        return slot
+
+    def join(self, room: str, user: str) -> int:
+        """Добавляет (или продлевает) участника, возвращает число участников"""
+        members = self._rooms.setdefault(room, {})
+        old_slot = members.get(user)
+        if old_slot is not None:
+            self._wheel[old_slot].discard((room, user))
+        members[user] = self._schedule(room, user)
+        if old_slot is None:
+            self._notify(room)
+        return len(members)
+
+    def heartbeat(self, room: str, user: str) -> bool:
+        """Продлевает участника. False - если его уже нет (нужен повторный join)"""
+        members = self._rooms.get(room)
+        if not members or user not in members:
+            return False
+        self._wheel[members[user]].discard((room, user))
+        members[user] = self._schedule(room, user)
+        return True
+
+    def leave(self, room: str, user: str) -> int:
+        """Удаляет участника, возвращает оставшееся число участников"""
+        members = self._rooms.get(room)
+        if not members or user not in members:
+            return self.count(room)
+        self._wheel[members.pop(user)].discard((room, user))
+        if not members:
+            del self._rooms[room]
+        self._notify(room)
+        return self.count(room)
+
+    def is_present(self, room: str, user: str) -> bool:
+        return user in self._rooms.get(room, ())
+
+    def count(self, room: str) -> int:
+        return len(self._rooms.get(room, ()))
+
+    def rooms(self) -> List[str]:
+        """Комнаты, в которых сейчас есть участники"""
+        return list(self._rooms)
+
+    def counts(self, rooms: Iterable[str]) -> Dict[str, int]:
+        return {room: self.count(room) for room in rooms}
+
+    def advance(self):
+        """Один тик колеса: истекают все участники из следующего слота"""
+        self._position = (self._position + 1) % len(self._wheel)
+        expired = self._wheel[self._position]
+        if not expired:
+            return
+        self._wheel[self._position] = set()
+        changed = set()
+        for room, user in expired:
+            members = self._rooms.get(room)
+            if members is None or members.get(user) != self._position:
+                continue
+            del members[user]
+            if not members:
+                del self._rooms[room]
+            changed.add(room)
+        for room in changed:
+            self._notify(room)
+        logger.info(f"Истекло присутствие участников: {len(expired)}")
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            self.advance()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def user_key(user: dict) -> str:
+    """Идентификатор пользователя из JWT payload (id есть не во всех токенах)"""
+    return str(user.get("id") or user.get("email"))
+
+
+presence = PresenceRegistry()
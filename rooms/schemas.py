@@ -0,0 +1,24 @@
+from typing import List
+
+from pydantic import BaseModel, Field
+
+from database import DEFAULT_ROOM_CAPACITY
+
+# Ограничение на размер одного пакетного запроса
+MAX_BULK_ROOMS = 1000
+# Больше этого mesh-звонок всё равно не тянет
+MAX_ROOM_CAPACITY = 50
+
+
+# ---- Schemas ----
+class RoomIn(BaseModel):
+    title: str = Field(default="Комната", min_length=1, max_length=255)
+    capacity: int = Field(default=DEFAULT_ROOM_CAPACITY, ge=1, le=MAX_ROOM_CAPACITY)
+
+
+class BulkCreateIn(BaseModel):
+    rooms: List[RoomIn] = Field(min_length=1, max_length=MAX_BULK_ROOMS)
+
+
+class BulkDeleteIn(BaseModel):
+    codes: List[str] = Field(min_length=1, max_length=MAX_BULK_ROOMS)
@@ -0,0 +1,152 @@
+# Общий модуль сервисов: одинаковые копии в chat_main, rooms и auth_reg, потому что
+# у каждого сервиса свой docker build context. Правится во всех трёх сразу,
+# расхождение ловит python tools/check_shared.py
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+# Импорт этого модуля - первое, что делает main.py, от него и отсчитываем старт
+PROCESS_STARTED = time.perf_counter()
+
+logger = logging.getLogger(__name__)
+
+
+class StartupReport:
+    """
+    Отчёт о холодном старте: время импортов и инициализации по компонентам.
+
+    Тяжёлые компоненты строятся в потоке во время startup, сервис
+    считается готовым (/ready), когда все они достроены.
+    """
+
+    def __init__(self):
+        self.phases: List[Dict[str, Any]] = []
+        self.ready_after: Optional[float] = None
+        # Процесс останавливается: новые клиенты сюда больше не нужны
+        self.stopping = False
+        self._pending: Set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+
+    def _record(self, name: str, kind: str, started: float):
+        self.phases.append({"name": name, "kind": kind, "seconds": round(time.perf_counter() - started, 6)})
+
+    @contextmanager
+    def measure(self, name: str, kind: str = "import"):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, kind, started)
+
+    def build_in_background(self, name: str, func: Callable[[], Any]):
+        """Синхронная инициализация в потоке, не блокируя event loop; готовность ждёт её"""
+        self._pending.add(name)
+
+        async def runner():
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(func)
+            except Exception:
+                # Компонент остаётся в pending - /ready так и будет отвечать 503
+                logger.exception(f"Не удалось инициализировать {name}")
+                return
+            self._record(name, "init", started)
+            self._pending.discard(name)
+            self._check_ready()
+
+        self._tasks.append(asyncio.create_task(runner()))
+
+    def finish_startup(self):
+        """Вызывается в конце startup: если фоновых компонентов нет, сервис готов сразу"""
+        self._check_ready()
+
+    def _check_ready(self):
+        if not self._pending and self.ready_after is None:
+            self.ready_after = time.perf_counter() - PROCESS_STARTED
+            logger.info("Startup report", extra={"startup": self.as_dict()})
+
+    def begin_shutdown(self):
+        self.stopping = True
+
+    @property
+    def initialized(self) -> bool:
+        """Все фоновые компоненты достроены (в отличие от ready, не зависит от остановки)"""
+        return self.ready_after is not None
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_after is not None and not self.stopping
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "pending": sorted(self._pending),
+            "ready_after_seconds": round(self.ready_after, 6) if self.ready_after is not None else None,
+            "phases": self.phases,
+        }
+
+
+class LazyTemplates:
+    """Jinja2Templates, которые импортируют jinja2 и создаются при первом обращении"""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self._templates = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._templates is None:
+            with self._lock:
+                if self._templates is None:
+                    from fastapi.templating import Jinja2Templates
+                    self._templates = Jinja2Templates(directory=self.directory)
+        return self._templates
+
+    def __getattr__(self, name: str):
+        return getattr(self.load(), name)
+
+
+startup_report = StartupReport()
+
+# До конца фоновой инициализации отвечают только пробы, метрики и статика
+STARTUP_OPEN_PATHS = ("/ready", "/startup", "/metrics", "/static/")
+
+
+class StartupGateMiddleware:
+    """
+    ASGI-middleware: пока фоновая инициализация не закончена, HTTP-запросы получают 503.
+
+    Иначе на свежей БД запросы доходили бы до обработчиков раньше, чем созданы таблицы.
+    WebSocket пропускается - эндпоинт сам отправляет клиента переподключаться.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or startup_report.initialized or scope["path"].startswith(STARTUP_OPEN_PATHS):
+            return await self.app(scope, receive, send)
+
+        response = JSONResponse({"detail": "Service is starting"}, status_code=503, headers={"Retry-After": "1"})
+        await response(scope, receive, send)
+
+
+async def ready_endpoint(request: Request) -> JSONResponse:
+    status_code = 200 if startup_report.ready else 503
+    return JSONResponse({"ready": startup_report.ready}, status_code=status_code)
+
+
+async def startup_endpoint(request: Request) -> JSONResponse:
+    return JSONResponse(startup_report.as_dict())
+
+
+def install_startup(app):
+    app.add_route("/ready", ready_endpoint, include_in_schema=False)
+    app.add_route("/startup", startup_endpoint, include_in_schema=False)
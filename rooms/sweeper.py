@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional, Set
+
+from database import RoomRepository
+from presence import PresenceRegistry, presence
+
+logger = logging.getLogger(__name__)
+
+# Как часто сбрасывать накопленные отметки активности в БД
+ACTIVITY_FLUSH_SECONDS = float(os.getenv("ACTIVITY_FLUSH_SECONDS", 60))
+# Через сколько дней без активности комната удаляется
+ROOM_IDLE_TTL_DAYS = float(os.getenv("ROOM_IDLE_TTL_DAYS", 30))
+# Период и размер пачки чистильщика
+ROOM_SWEEP_INTERVAL_SECONDS = float(os.getenv("ROOM_SWEEP_INTERVAL_SECONDS", 600))
+ROOM_SWEEP_BATCH_SIZE = int(os.getenv("ROOM_SWEEP_BATCH_SIZE", 100))
+# archive - переносить в rooms_archive, delete - удалять насовсем
+ROOM_SWEEP_MODE = os.getenv("ROOM_SWEEP_MODE", "archive")
+# Компактизация rooms.db раз в N проходов
+ROOM_COMPACT_EVERY = int(os.getenv("ROOM_COMPACT_EVERY", 6))
+
+
+class ActivityTracker:
+    """
+    Отметки активности комнат в памяти.
+
+    Просмотры страниц и heartbeat только добавляют код в множество,
+    в БД они уходят одним UPDATE ... WHERE code IN (...) раз в flush_interval.
+    """
+
+    def __init__(self, flush_interval: float = ACTIVITY_FLUSH_SECONDS):
+        self.flush_interval = flush_interval
+        self._pending: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def touch(self, code: str):
+        self._pending.add(code)
+
+    async def flush(self):
+        if not self._pending:
+            return
+        codes, self._pending = list(self._pending), set()
+        try:
+            await RoomRepository.touch_rooms(codes, datetime.now(timezone.utc))
+        except Exception as e:
+            # Не теряем отметки: вернём их в следующий сброс
+            self._pending.update(codes)
+            logger.error(f"Ошибка записи активности комнат: {e}")
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+class RoomSweeper:
+    """
+    Фоновый чистильщик неактивных комнат.
+
+    Работает небольшими пачками с передачей управления event loop между ними,
+    комнаты с участниками (по реестру присутствия) не трогает.
+    """
+
+    def __init__(
+            self,
+            tracker: ActivityTracker,
+            registry: PresenceRegistry,
+            ttl: timedelta = timedelta(days=ROOM_IDLE_TTL_DAYS),
+            interval: float = ROOM_SWEEP_INTERVAL_SECONDS,
+            batch_size: int = ROOM_SWEEP_BATCH_SIZE,
+            archive: bool = ROOM_SWEEP_MODE == "archive",
+            compact_every: int = ROOM_COMPACT_EVERY,
+    ):
+        self.tracker = tracker
+        self.presence = registry
+        self.ttl = ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.archive = archive
+        self.compact_every = compact_every
+        self._sweeps = 0
+        self._task: Optional[asyncio.Task] = None
+        # Подписчики на удаление комнат: callback(codes)
+        self._listeners: List[Callable[[List[str]], None]] = []
+
+    def add_listener(self, callback: Callable[[List[str]], None]):
+        self._listeners.append(callback)
+
+    async def sweep(self) -> int:
+        """Один проход: возвращает число удалённых комнат"""
+        # Сначала сбрасываем свежие отметки, чтобы не удалить только что активную комнату
+        await self.tracker.flush()
+        cutoff = datetime.now(timezone.utc) - self.ttl
+        removed = 0
+        while True:
+            codes = await RoomRepository.sweep_idle_rooms(
+                cutoff, self.batch_size, self.presence.rooms(), self.archive
+            )
+            removed += len(codes)
+            for callback in self._listeners:
+                callback(codes)
+            if len(codes) < self.batch_size:
+                break
+            await asyncio.sleep(0)
+
+        self._sweeps += 1
+        if self.compact_every and self._sweeps % self.compact_every == 0:
+            await RoomRepository.compact()
+        return removed
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Ошибка чистильщика комнат: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+activity_tracker = ActivityTracker()
+room_sweeper = RoomSweeper(activity_tracker, presence)
@@ -0,0 +1,79 @@
+import base64
+import hashlib
+import hmac
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from metrics import Counter
+
+# Общий секрет с coturn (use-auth-secret + static-auth-secret в turnserver.conf)
+TURN_SECRET = os.getenv("TURN_SECRET", "")
+TURN_URLS = [
+    url for url in (os.getenv(name) for name in ("TURN_URL_UDP", "TURN_URL_TCP", "TURNS_URL_UDP", "TURNS_URL_TCP"))
+    if url
+]
+# Сколько действует выданный пароль
+TURN_CREDENTIAL_TTL_SECONDS = int(os.getenv("TURN_CREDENTIAL_TTL_SECONDS", 24 * 3600))
+# В пределах интервала повторный вход получает тот же пароль из кэша
+TURN_CREDENTIAL_BUCKET_SECONDS = int(os.getenv("TURN_CREDENTIAL_BUCKET_SECONDS", 3600))
+
+ROOMS_TURN_CREDENTIALS = Counter("rooms_turn_credentials_total", "Выданные TURN-пароли", ["result"])
+
+
+class TurnCredentials:
+    """
+    Временные пароли TURN REST API для участников комнат.
+
+    Имя - "<истечение>:<пользователь>:<комната>", пароль - base64(HMAC-SHA1(имя, секрет)).
+    coturn проверяет только срок и подпись, а имя пишет в лог сессии и считает
+    по нему user-quota: трафик релея привязан к пользователю и комнате.
+    Истечение отсчитывается от начала интервала TURN_CREDENTIAL_BUCKET_SECONDS,
+    поэтому внутри интервала имя и пароль не меняются и берутся из кэша без HMAC.
+    """
+
+    def __init__(
+            self,
+            secret: str = TURN_SECRET,
+            ttl: int = TURN_CREDENTIAL_TTL_SECONDS,
+            bucket: int = TURN_CREDENTIAL_BUCKET_SECONDS,
+    ):
+        self.secret = secret.encode()
+        self.ttl = ttl
+        # Интервал короче срока действия, иначе пароль выдавался бы уже истёкшим
+        self.bucket = max(1, min(bucket, ttl // 2))
+        self._bucket_start: Optional[int] = None
+        # (пользователь, комната) -> (имя, пароль, истечение) текущего интервала
+        self._cache: Dict[Tuple[str, str], Tuple[str, str, int]] = {}
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.secret and TURN_URLS)
+
+    def _sign(self, username: str) -> str:
+        digest = hmac.new(self.secret, username.encode(), hashlib.sha1).digest()
+        return base64.b64encode(digest).decode()
+
+    def issue(self, user: str, room: str, now: Optional[float] = None) -> Dict:
+        now = int(time.time() if now is None else now)
+        bucket_start = now - now % self.bucket
+        if bucket_start != self._bucket_start:
+            # Пароли прошлого интервала больше не выдаются - кэш не растёт дольше интервала
+            self._cache.clear()
+            self._bucket_start = bucket_start
+
+        credential = self._cache.get((user, room))
+        if credential is None:
+            expires = bucket_start + self.ttl
+            username = f"{expires}:{user}:{room}"
+            credential = (username, self._sign(username), expires)
+            self._cache[(user, room)] = credential
+            ROOMS_TURN_CREDENTIALS.inc(result="issued")
+        else:
+            ROOMS_TURN_CREDENTIALS.inc(result="cached")
+
+        username, password, expires = credential
+        return {"username": username, "password": password, "ttl": expires - now, "uris": TURN_URLS}
+
+
+turn_credentials = TurnCredentials()
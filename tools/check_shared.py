@@ -0,0 +1,47 @@
+"""
+Проверка, что общие модули сервисов не разошлись.
+
+metrics.py, profiling.py и startup.py скопированы в chat_main, rooms и auth_reg
+(у каждого сервиса свой docker build context), копии должны совпадать побайтно.
+Если какая-то копия отличается от chat_main, скрипт печатает diff и завершается с кодом 1.
+
+Пример:
+    python tools/check_shared.py
+"""
+import difflib
+import sys
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+SHARED_MODULES = ("metrics.py", "profiling.py", "startup.py")
+# Эталонная копия - в chat_main, остальные сверяются с ней
+SERVICES = ("chat_main", "rooms", "auth_reg")
+
+
+def main() -> int:
+    failed = False
+    for module in SHARED_MODULES:
+        reference_path = REPO_DIR / SERVICES[0] / module
+        reference = reference_path.read_text(encoding="utf-8")
+        for service in SERVICES[1:]:
+            path = REPO_DIR / service / module
+            copy = path.read_text(encoding="utf-8")
+            if copy == reference:
+                continue
+            failed = True
+            sys.stdout.writelines(difflib.unified_diff(
+                reference.splitlines(keepends=True),
+                copy.splitlines(keepends=True),
+                fromfile=str(reference_path.relative_to(REPO_DIR)),
+                tofile=str(path.relative_to(REPO_DIR)),
+            ))
+    if failed:
+        print("Общие модули разошлись: поправьте копии во всех сервисах", file=sys.stderr)
+        return 1
+    print("Общие модули совпадают")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -21,6 +21,11 @@ let politePeer = {};  // {socketId: boolean}
 let videoEnabled = true;
 let audioEnabled = true;
 
+// Код комнаты передаёт страница комнаты: iframe /webrtc/?room=...
+const roomCode = new URLSearchParams(location.search).get("room");
+const STUN_SERVER = { urls: ['stun:stun.l.google.com:19302','stun:stun1.l.google.com:19302'] };
+let iceServersPromise = null;
+
 /* ------------------------------------------------------
     1. Получение камеры и микрофона
 ------------------------------------------------------ */
@@ -132,21 +137,28 @@ document.body.appendChild(controls);
 /* ------------------------------------------------------
     3. Создание PeerConnection
 ------------------------------------------------------ */
-async function createPeerConnection(socketId) {
-    const config = await fetch("/webrtc/config").then(r => r.json());
-    const configuration = {
-        iceServers: [
-            { urls: ['stun:stun.l.google.com:19302','stun:stun1.l.google.com:19302'] },
-            {
-                urls: [config.turnUdp, config.turnTcp, config.turnsUdp, config.turnsTcp],
-                username: config.username,
-                credential: config.password
-            }
-        ]
-    };
+// TURN-пароль выдаёт rooms на пользователя и комнату - один запрос на страницу, а не на каждого пира
+function getIceServers() {
+    iceServersPromise ??= loadIceServers();
+    return iceServersPromise;
+}
 
+async function loadIceServers() {
+    if (!roomCode) return [STUN_SERVER];
+    const resp = await fetch(`/rooms/api/room/${encodeURIComponent(roomCode)}/turn`);
+    if (!resp.ok) {
+        console.warn("TURN недоступен:", resp.status);
+        // Следующий пир попробует ещё раз
+        iceServersPromise = null;
+        return [STUN_SERVER];
+    }
+    const turn = await resp.json();
+    return [STUN_SERVER, { urls: turn.uris, username: turn.username, credential: turn.password }];
+}
+
+async function createPeerConnection(socketId) {
     const peer = new RTCPeerConnection({
-        configuration,
+        iceServers: await getIceServers(),
         sdpSemantics: "unified-plan"
     });
 
@@ -4,37 +4,13 @@ const http = require('http').createServer(app);
 const io = require('socket.io')(http, {
     path: '/webrtc/socket.io'
 });
-const CryptoJS = require("crypto-js");
 
 app.use(express.static('public'));
 
 const ROOM = 'main-room';
 let users = {};
 
-function generateTurnCredentials(realm, secret) {
-  // <timestamp>:<realm>
-  const timestamp = Math.floor(Date.now()/1000) + 24*3600; // TTL 24h
-  const username = `${timestamp}:${realm}`;
-
-  // HMAC-SHA1(username, secret) → Base64
-  const password = CryptoJS.HmacSHA1(username, secret)
-    .toString(CryptoJS.enc.Base64);
-
-  return { username, password };
-}
-
-app.get("/config", (req, res) => {
-  const creds = generateTurnCredentials(process.env.TURN_REALM, process.env.TURN_SECRET);
-
-  res.json({
-    turnUdp: process.env.TURN_URL_UDP,
-    turnTcp: process.env.TURN_URL_TCP,
-    turnsUdp: process.env.TURNS_URL_UDP,
-    turnsTcp: process.env.TURNS_URL_TCP,
-    username: creds.username,
-    password: creds.password
-  });
-});
+// TURN-пароли выдаёт rooms (/rooms/api/room/{code}/turn) на пользователя и комнату
 
 io.on('connection', socket => {
     console.log('New user connected:', socket.id);